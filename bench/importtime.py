@@ -0,0 +1,46 @@
+import argparse
+import subprocess
+import sys
+
+# tracks how long `import wawona.wawona` takes, as reported by `python -X importtime`
+# usage: python bench/importtime.py [--runs N] [--top N] [--budget MS]
+
+MODULE = "wawona.wawona"
+
+
+def measure(module):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % module],
+                            capture_output=True, text=True, check=True)
+    timings = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of %s" % MODULE)
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters to sample")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    parser.add_argument("--budget", type=float, help="fail if the best run exceeds this many milliseconds")
+    args = parser.parse_args()
+
+    runs = [measure(MODULE) for _ in range(args.runs)]
+    best = min(runs, key=lambda timings: timings[MODULE])
+    total_ms = best[MODULE] / 1000
+    print("%s: %.1f ms (best of %d)" % (MODULE, total_ms, args.runs))
+    for name, cumulative in sorted(best.items(), key=lambda item: -item[1])[:args.top]:
+        print("  %8.1f ms  %s" % (cumulative / 1000, name))
+    for heavy in ("selenium", "inquirer", "texttable", "pytz", "requests"):
+        if heavy in best:
+            print("WARNING: %s is imported eagerly" % heavy)
+    if args.budget is not None and total_ms > args.budget:
+        print("FAIL: over budget of %.1f ms" % args.budget)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
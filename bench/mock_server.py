@@ -0,0 +1,294 @@
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import threading
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, urlparse
+
+# offline stand-in for the hrx-backend endpoints used by wawona
+# usage: python bench/mock_server.py --port 8080 --followings 200 --latency 0.05
+# then: WAWONA_API_BASE=http://127.0.0.1:8080/rtw/ wawona
+
+PREFIX = "/rtw/"
+QUESTIONNAIRE = {
+    "hasQuestionnaire": True,
+    "hasDocumentAck": False,
+    "questions": [{
+        "questionId": "q1",
+        "questionTitle": "I am healthy and not sick?",
+        "answerType": "SINGLE_SELECT",
+        "questionCategory": "ALL_USERS",
+        "choices": [{"choiceId": "c1", "choiceLabel": "Yes", "choiceType": "QUALIFY"}],
+    }],
+}
+
+
+def format_date(dt):
+    return "%02d-%02d-%d" % (dt.day, dt.month, dt.year)
+
+
+def parse_date(dt):
+    day, month, year = dt.split("-")
+    return date(int(year), int(month), int(day))
+
+
+class Backend:
+    def __init__(self, followings=10, floors=2, spaces=40, tasks=1, booked_ratio=0.3, latency=0.0, error_rate=0.0,
+                 seed=0, compress=True, etags=True, full_days=()):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.compress = compress
+        self.etags = etags
+        # YYYY-MM-DD days on which the office rejects reservations
+        self.full_days = set(full_days)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0
+        self.bytes_sent = 0
+        self.not_modified = 0
+        self.endpoints = {}
+        self.booked_days = set()
+        self.tasks = {}
+        self.next_id = 1000
+        today = date.today()
+        horizon = [today + timedelta(days=x) for x in range(-7, 60)]
+        self.followings = []
+        for i in range(followings):
+            days = [x for x in horizon if x.weekday() < 5 and self.random.random() < 0.4]
+            self.followings.append({
+                "fullName": "Coworker %d" % i,
+                "reservationsMetadata": [{"reservationStartTime": "%s 08:00:00" % x.isoformat()} for x in days],
+            })
+        self.floors = []
+        self.spaces = {}
+        self.occupants = {}
+        # (day, uniqueSpaceId) -> name, for spaces booked through the API
+        self.reserved = {}
+        for i in range(floors):
+            floor_id = "floor-%d" % i
+            self.floors.append({"floorId": floor_id, "floorName": "Floor %d" % (i + 1), "status": "active",
+                                "baseWidth": 2000, "aspectRatio": 0.5, "blueprintUrl": "https://example.com/%d" % i})
+            columns = max(1, int(spaces ** 0.5 * 2))
+            self.spaces[floor_id] = [{
+                "spaceId": str(j + 1),
+                "uniqueSpaceId": "%s-%d" % (floor_id, j + 1),
+                "label": "Desk %d" % (j + 1),
+                "Rx": 50 + (j % columns) * 1900 // columns,
+                "Ry": 50 + (j // columns) * 900 // max(1, spaces // columns),
+            } for j in range(spaces)]
+            for space in self.spaces[floor_id]:
+                if self.random.random() < booked_ratio:
+                    name = "Coworker %d" % self.random.randrange(max(1, followings * 3))
+                    self.occupants[space["uniqueSpaceId"]] = name
+        for i in range(tasks):
+            self.add_task(today + timedelta(days=i))
+
+    def add_task(self, day, reservation_id=None):
+        with self.lock:
+            task_id = str(self.next_id)
+            self.next_id += 1
+        self.tasks[task_id] = {
+            "taskId": task_id,
+            "taskTitle": "Reservation Acknowledgement Pending",
+            "taskMetadata": {
+                "data": dict(QUESTIONNAIRE),
+                "cardInfo": {"displayTitle": day.strftime("%b %d"), "title": "Mock Office", "heading": "Reservation",
+                             "basicSubtitle": "Complete Self-Screening", "caption": "Seat Not Selected"},
+            },
+            "spaceBookingEnabled": bool(self.floors),
+            "reservationStartTime": "%sT12:00:00Z" % day.isoformat(),
+            "reservationEndTime": "%sT21:59:00Z" % day.isoformat(),
+            "recipientId": "me",
+            "reservationId": reservation_id or "resv-%s" % task_id,
+        }
+        return task_id
+
+    def record(self, endpoint, size, not_modified=False):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += size
+            self.not_modified += not_modified
+            count, total = self.endpoints.get(endpoint, (0, 0))
+            self.endpoints[endpoint] = (count + 1, total + size)
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "errors": self.errors, "connections": self.connections,
+                    "bytes": self.bytes_sent, "not_modified": self.not_modified, "endpoints": dict(self.endpoints)}
+
+    def inject_error(self):
+        with self.lock:
+            if self.random.random() >= self.error_rate:
+                return False
+            self.errors += 1
+            return True
+
+    def get(self, endpoint, params):
+        if endpoint == "client/pending-task":
+            return {"tasks": [{"taskId": x} for x in self.tasks]}
+        if endpoint == "client/task/info":
+            return self.tasks[params["taskId"]]
+        if endpoint == "client/dashboard/summary":
+            start, end = parse_date(params["statStart"]), parse_date(params["statEnd"])
+            return {"weeklyStats": [{"date": format_date(x)} for x in sorted(self.booked_days) if start <= x <= end]}
+        if endpoint == "client/followings":
+            return {"followings": self.followings}
+        if endpoint == "resv/client/locations":
+            return {"locations": [{"locationName": "Mock Office", "locationId": "loc-1",
+                                   "locationTimezone": "America/New_York"}]}
+        if endpoint == "client/space-bookings/floors":
+            return {"floors": self.floors}
+        if endpoint.startswith("client/space-bookings/"):
+            adjective = endpoint.split("/")[2]
+            day = params.get("startTime", "")[:10]
+            out = []
+            for space in self.spaces.get(params.get("floorId"), []):
+                unique_space_id = space["uniqueSpaceId"]
+                occupant = self.occupants.get(unique_space_id) or self.reserved.get((day, unique_space_id))
+                if adjective == "available" and not occupant:
+                    out.append(space)
+                elif adjective == "booked" and occupant:
+                    first_name, last_name = occupant.split(" ", 1)
+                    out.append(dict(space, firstName=first_name, lastName=last_name))
+            return {"spaces": out}
+        return None
+
+    def post(self, endpoint, body):
+        if endpoint == "resv/client/reservations":
+            out = []
+            for reservation in body.get("reservations", []):
+                if reservation["startTimeUtc"][:10] in self.full_days:
+                    raise ValueError("Location is full on %s" % reservation["startTimeUtc"][:10])
+            for reservation in body.get("reservations", []):
+                day = date.fromisoformat(reservation["startTimeUtc"][:10])
+                self.booked_days.add(day)
+                reservation_id = "resv-%s-%d" % (day.isoformat(), len(self.booked_days))
+                self.add_task(day, reservation_id)
+                out.append({"reservationId": reservation_id})
+            return {"reservations": out}
+        if endpoint == "client/task-response":
+            task = self.tasks.get(body.get("taskId"))
+            if task:
+                task["taskMetadata"]["data"] = None
+            return {}
+        if endpoint == "client/space-bookings/space":
+            space_id = body["spaceId"]
+            key = (body.get("startTime", "")[:10], space_id)
+            if space_id in self.occupants or key in self.reserved:
+                raise ValueError("Space already booked")
+            self.reserved[key] = "Mock Me"
+            task = self.tasks.pop(body.get("taskId"), None)
+            if task:
+                self.booked_days.add(date.fromisoformat(task["reservationStartTime"][:10]))
+            return {"label": "Desk %s" % space_id.rsplit("-", 1)[-1]}
+        return None
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    backend: Backend = None
+
+    def setup(self):
+        super().setup()
+        with self.backend.lock:
+            self.backend.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, endpoint, status, payload):
+        body = json.dumps(payload).encode()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if status == 200 and self.backend.etags and self.command == "GET":
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                self.backend.record(endpoint, 0, True)
+                return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if status == 200 and self.backend.etags:
+            self.send_header("ETag", etag)
+        if self.backend.compress and "gzip" in (self.headers.get("Accept-Encoding") or "") and len(body) > 1024:
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.backend.record(endpoint, len(body))
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        endpoint = url.path[len(PREFIX):] if url.path.startswith(PREFIX) else url.path
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.backend.latency:
+            sleep(self.backend.latency)
+        if method == "GET" and self.backend.inject_error():
+            return self.reply(endpoint, 503, {"success": False, "message": "Injected error"})
+        if not self.headers.get("token"):
+            return self.reply(endpoint, 401, {"success": False, "message": "Missing token"})
+        try:
+            data = self.backend.get(endpoint, params) if method == "GET" else self.backend.post(endpoint, body)
+        except (KeyError, ValueError) as e:
+            return self.reply(endpoint, 400, {"success": False, "message": str(e)})
+        if data is None:
+            return self.reply(endpoint, 404, {"success": False, "message": "Unknown endpoint %s" % endpoint})
+        self.reply(endpoint, 200, {"success": True, "data": data})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+
+def start(backend, port=0):
+    handler = type("BoundHandler", (Handler,), {"backend": backend})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_backend_arguments(parser):
+    parser.add_argument("--followings", type=int, default=10, help="number of followed coworkers")
+    parser.add_argument("--floors", type=int, default=2, help="number of floors")
+    parser.add_argument("--spaces", type=int, default=40, help="number of spaces per floor")
+    parser.add_argument("--tasks", type=int, default=1, help="number of initially pending tasks")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of GETs failing with a 503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--full-days", type=lambda x: x.split(","), default=[], metavar="DAYS",
+                        help="comma separated YYYY-MM-DD days on which reservations are rejected")
+    parser.add_argument("--no-compress", dest="compress", action="store_false", help="never gzip responses")
+    parser.add_argument("--no-etags", dest="etags", action="store_false", help="never send ETags or 304s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline mock of the hrx-backend endpoints used by wawona")
+    parser.add_argument("--port", type=int, default=8080)
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+    backend = Backend(followings=args.followings, floors=args.floors, spaces=args.spaces, tasks=args.tasks,
+                      latency=args.latency, error_rate=args.error_rate, seed=args.seed, compress=args.compress,
+                      etags=args.etags, full_days=args.full_days)
+    server = start(backend, args.port)
+    print("Serving on http://127.0.0.1:%d%s (ctrl-c to stop)" % (server.server_port, PREFIX))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(json.dumps(backend.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
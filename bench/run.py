@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from statistics import median
+from time import perf_counter
+
+import mock_server
+
+# drives `wawona` end to end against the mock backend, answering every prompt with its default
+# usage: python bench/run.py [--scenario NAME ...] [--runs N] [--warm] [--timeout S] [--json] [-- wawona args]
+
+SCENARIOS = {
+    "baseline": {},
+    "large-org": {"followings": 500, "floors": 10, "spaces": 400},
+    "slow-network": {"latency": 0.1},
+    "flaky": {"error_rate": 0.1},
+    "many-tasks": {"tasks": 5, "floors": 4},
+}
+CONFIG = {"version": "1", "preferred_space_id": "3", "start_hour": 8, "end_hour": 18}
+# the same question asked again straight away means the previous answer was refused, so the next choice is tried
+MAX_REASKS = 5
+# seconds a single run of wawona may take before the scenario counts as failed
+TIMEOUT = 120
+
+
+def drive(argv):
+    import inquirer
+
+    last = {"question": None, "asked": 0}
+
+    def prompt(questions):
+        answers = {}
+        for question in questions:
+            choices = [getattr(x, "value", x) for x in question.choices]
+            asked = (question.name, question.default, choices)
+            if asked == last["question"]:
+                last["asked"] += 1
+            else:
+                last["question"], last["asked"] = asked, 0
+            if isinstance(question, inquirer.Checkbox):
+                answers[question.name] = choices[:1]
+                continue
+            candidates = [question.default] if question.default is not None else []
+            candidates += [x for x in choices if x != question.default] or [""]
+            if last["asked"] >= min(MAX_REASKS, len(candidates)):
+                raise SystemExit("gave up on %r after %d answers were refused" % (question.name, last["asked"]))
+            answers[question.name] = candidates[last["asked"]]
+        return answers
+
+    inquirer.prompt = prompt
+    inquirer.confirm = lambda message, default=False, **kwargs: True
+    inquirer.text = lambda message, **kwargs: ""
+    os.get_terminal_size = lambda *args: os.terminal_size((120, 40))
+    from wawona import wawona
+    sys.argv = ["wawona"] + argv
+    wawona.run()
+
+
+def drive_once(name, env, wawona_args, verbose, timeout):
+    start = perf_counter()
+    try:
+        result = subprocess.run([sys.executable, __file__, "--drive", "--"] + wawona_args, env=env,
+                                stdin=subprocess.DEVNULL, stdout=None if verbose else subprocess.PIPE,
+                                stderr=subprocess.STDOUT, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired as e:
+        output = e.output or ""
+        print(output if isinstance(output, str) else output.decode(errors="replace"), file=sys.stderr)
+        raise SystemExit("scenario %s timed out after %ds" % (name, timeout))
+    elapsed = perf_counter() - start
+    if result.returncode:
+        print(result.stdout or "", file=sys.stderr)
+        raise SystemExit("scenario %s failed with exit code %d" % (name, result.returncode))
+    return elapsed
+
+
+def run_scenario(name, overrides, wawona_args, verbose, warm=False, timeout=TIMEOUT):
+    backend = mock_server.Backend(**overrides)
+    server = mock_server.start(backend)
+    with tempfile.TemporaryDirectory() as home:
+        config_path = "%s/.config/wawona" % home
+        os.makedirs(config_path)
+        with open("%s/config.json" % config_path, "w") as f:
+            json.dump(CONFIG, f)
+        with open("%s/token.txt" % config_path, "w") as f:
+            f.write("mock-token")
+        env = dict(os.environ, HOME=home,
+                   WAWONA_API_BASE="http://127.0.0.1:%d%s" % (server.server_port, mock_server.PREFIX))
+        if warm:
+            # an untimed run first, so that the measured one starts from a filled cache
+            drive_once(name, env, wawona_args, False, timeout)
+            backend = mock_server.Backend(**overrides)
+            server.RequestHandlerClass.backend = backend
+        elapsed = drive_once(name, env, wawona_args, verbose, timeout)
+    server.shutdown()
+    server.server_close()
+    stats = backend.stats()
+    stats["seconds"] = elapsed
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark wawona against the offline mock backend")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (default: all)")
+    parser.add_argument("--runs", type=int, default=3, help="runs per scenario, the median is reported")
+    parser.add_argument("--warm", action="store_true", help="measure a second run sharing the first one's cache")
+    parser.add_argument("--timeout", type=int, default=TIMEOUT, help="seconds before a run counts as failed")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the output of wawona")
+    parser.add_argument("--drive", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("wawona_args", nargs="*", help="extra arguments passed to wawona")
+    args = parser.parse_args()
+    if args.drive:
+        drive(args.wawona_args)
+        return
+
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        runs = [run_scenario(name, SCENARIOS[name], args.wawona_args, args.verbose, args.warm,
+                             args.timeout)
+                for _ in range(args.runs)]
+        best = sorted(runs, key=lambda x: x["seconds"])[len(runs) // 2]
+        best["seconds"] = median(x["seconds"] for x in runs)
+        results[name] = best
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("%-14s %10s %9s %12s %12s %7s %6s" % ("scenario", "wall (s)", "requests", "connections", "bytes", "errors",
+                                                "304s"))
+    for name, stats in results.items():
+        print("%-14s %10.3f %9d %12d %12d %7d %6d" % (name, stats["seconds"], stats["requests"], stats["connections"],
+                                                       stats["bytes"], stats["errors"], stats["not_modified"]))
+
+
+if __name__ == "__main__":
+    main()
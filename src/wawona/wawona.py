@@ -1,25 +1,62 @@
+import argparse
+import copy
+import hashlib
+import io
 import json
 import locale
 import os
+import random
 import re
+import shutil
 import sys
+import threading
+from array import array
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import date, datetime, time, timedelta
-from os.path import isfile, isdir, exists
+from functools import lru_cache
+from math import hypot, inf
+from os.path import abspath, expanduser, isfile, isdir, exists
 from time import sleep
+from time import perf_counter, time as now
+from unicodedata import east_asian_width
 from urllib.parse import unquote
 
-import inquirer
-import pytz
-import requests
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-from texttable import Texttable
 
-config_path = "%s/.config/wawona" % os.environ["HOME"]
-config_file = "%s/config.json" % config_path
-token_file = "%s/token.txt" % config_path
+def new_account(config_path):
+    # everything that belongs to one person, so that one process can act for several
+    return {
+        "config_path": config_path,
+        "config_file": "%s/config.json" % config_path,
+        "token_file": "%s/token.txt" % config_path,
+        "token_meta_file": "%s/token.json" % config_path,
+        "cache_path": "%s/cache" % config_path,
+        "state_file": "%s/state.db" % config_path,
+        "daemon_socket": "%s/daemon.sock" % config_path,
+        "session": None,
+        "memo": {},
+        "memo_inflight": {},
+        "memo_generation": 0,
+        "memo_stats": {"hits": 0, "misses": 0, "coalesced": 0},
+        # set once anything was posted, so that a running daemon can be told to refresh
+        "mutated": False,
+        "state": None,
+        "token_lock": threading.RLock(),
+        # set once a proactive refresh could not be done without a visible browser
+        "token_deferred": False,
+        # set when nobody is at the keyboard, so that a login never waits on a visible browser
+        "unattended": False,
+    }
+
+
+default_account = new_account("%s/.config/wawona" % os.environ["HOME"])
+_account = ContextVar("account", default=default_account)
+
+
+def account():
+    return _account.get()
+
 
 TERMINAL_CHAR_ASPECT_RATIO = 8 / 10
 FLOOR_PLAN_BUFFER = 4
@@ -28,7 +65,12 @@ COLOR_AVAILABLE = "32"
 COLOR_BOOKED_FOLLOWING = "36"
 COLOR_BOOKED = "31"
 COLOR_PREFERRED = "35"
-DOT = "\u25CF"
+# each character cell shows two spaces stacked vertically
+UPPER_HALF = "\u2580"
+LOWER_HALF = "\u2584"
+FULL_BLOCK = "\u2588"
+# when spaces land on the same spot, the most useful one wins
+COLOR_PRIORITY = [COLOR_PREFERRED, COLOR_BOOKED_FOLLOWING, COLOR_AVAILABLE, COLOR_BOOKED]
 
 BROWSER_HASH = "1032275734"
 HEADERS = {
@@ -43,83 +85,630 @@ HEADERS = {
     'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
                   'Chrome/122.0.0.0 Safari/537.36'
 }
+API_CONNECT_TIMEOUT = 5
+API_READ_TIMEOUT = 30
+API_POOL_SIZE = 10
+API_RETRIES = 3
+API_BACKOFF = 0.5
+API_BACKOFF_MAX = 4
+PREFETCH_WORKERS = 4
+WEEKS = 2
+TASK_WORKERS = 8
+RESERVATION_ATTEMPTS = 3
+TASK_POLL_DEADLINE = 30
+TASK_POLL_INITIAL_DELAY = 0.25
+TASK_POLL_MAX_DELAY = 2
+WATCH_INTERVAL = 5
+WATCH_MAX_INTERVAL = 60
+WATCH_DEADLINE = 3600
+# requests per second across all watched tasks, however many there are
+WATCH_RATE = 2
+DAEMON_INTERVAL = 60
+LOGIN_WAIT = 300
+# a remembered login redirects on its own, so a headless browser does not need long
+HEADLESS_LOGIN_WAIT = 20
+# and when it does not, the page settles on the login form within a few seconds
+HEADLESS_LOGIN_SETTLE = 3
+TOKEN_REFRESH_MARGIN = 600
+TEAM_WORKERS = 4
+TEAM_RATE = 10
+DAEMON_TIMEOUT = 2
+# what the daemon keeps warm, refetched on every refresh
+DAEMON_ENDPOINTS = ["client/dashboard/summary", "client/followings", "client/pending-task"]
+API_BASE = os.environ.get("WAWONA_API_BASE", "https://hrx-backend.sequoia.com/rtw/")
+# endpoint: (seconds fresh, seconds served stale while revalidating)
+CACHE_TTLS = {
+    "resv/client/locations": (24 * 3600, 7 * 24 * 3600),
+    "client/space-bookings/floors": (24 * 3600, 7 * 24 * 3600),
+}
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+# GET endpoints which are always refetched, but conditionally when the last response had a validator
+CONDITIONAL_ENDPOINTS = [
+    "client/dashboard/summary",
+    "client/followings",
+    "client/space-bookings/",
+]
+# GET endpoints whose responses are reused for the rest of the run
+MEMO_ENDPOINTS = [
+    "client/dashboard/summary",
+    "client/followings",
+    "client/task/info",
+    "client/space-bookings/",
+    "resv/client/locations",
+]
+# POST endpoint: GET endpoints whose responses it changes
+MEMO_INVALIDATIONS = {
+    "resv/client/reservations": ["client/dashboard/summary", "client/followings", "client/task/info"],
+    "client/task-response": ["client/task/info", "client/space-bookings/"],
+    "client/space-bookings/space": ["client/dashboard/summary", "client/task/info", "client/space-bookings/"],
+}
+# how close a free space must be to a followed coworker, relative to the floor width
+NEAR_RADIUS_RATIO = 0.1
+SCAN_MAX_NAMES = 3
 CHECK_MARK = "\u2705"
+CROSS_MARK = "\u274c"
+# the five weekdays, counted from the monday a week starts on
+WEEKDAY_BITS = 0b11111
+# the columns of --format csv, every record has a subset of them
+RECORD_FIELDS = ["type", "date", "name", "id", "reserved", "floor", "available", "booked"]
 CONFIG_VERSION = 1
 YOU = "You"
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+EXIT_FAILED = 1
+EXIT_INCOMPLETE = 3
 
 VERBOSE = False
-for arg in sys.argv:
-    if arg == "reset":
-        print("Removing config file")
-        os.remove(config_file)
-    elif arg == "--verbose":
-        VERBOSE = True
+NO_CACHE = False
+PROFILE = False
+# requests per second across all accounts, None for no limit
+RATE_LIMIT = None
 
 
 class ApiException(Exception):
     pass
 
 
-def api_call(method, url, **kwargs):
+class ApiRejected(ApiException):
+    # the backend understood the request and said no, so trying again will not help
+    pass
+
+
+class ApiUnauthorized(ApiException):
+    # the token was refused, which is the only failure that logging in again can fix
+    pass
+
+
+class ContextExecutor(ThreadPoolExecutor):
+    # runs every task in the context of its caller, which carries the account
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(copy_context().run, fn, *args, **kwargs)
+
+
+_session_lock = threading.Lock()
+
+
+def get_session():
+    current = account()
+    with _session_lock:
+        if current["session"] is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            # keep connections to the backend alive across calls (and across threads)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(HEADERS)
+            current["session"] = session
+        return current["session"]
+
+
+def backoff_delay(attempt):
+    # full jitter, bounded by API_BACKOFF_MAX
+    return random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF * (2 ** attempt)))
+
+
+_trace_events = []
+_trace_lock = threading.Lock()
+_trace_origin = perf_counter()
+
+
+def trace_event(name, category, start, end=None, **args):
+    if not PROFILE:
+        return
+    end = perf_counter() if end is None else end
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": round((start - _trace_origin) * 1e6),
+        "dur": round((end - start) * 1e6),
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+        "args": args,
+    }
+    with _trace_lock:
+        _trace_events.append(event)
+
+
+@contextmanager
+def phase(name):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        trace_event(name, "phase", start)
+
+
+def write_profile(path):
+    from texttable import Texttable
+    with _trace_lock:
+        events = list(_trace_events)
+    with open(path, 'w') as f:
+        # chrome://tracing and https://ui.perfetto.dev understand this format
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    summary = {}
+    for event in events:
+        key = (event["cat"], event["name"])
+        row = summary.setdefault(key, [0, 0, 0, 0, 0, 0])
+        args = event["args"]
+        row[0] += 1
+        row[1] += event["dur"]
+        row[2] = max(row[2], event["dur"])
+        row[3] += args.get("bytes", 0)
+        row[4] += args.get("saved", 0)
+        row[5] += args.get("retries", 0)
+    rows = [["", "Count", "Total ms", "Max ms", "Bytes", "Saved", "Retries"]]
+    for (category, name), (count, total, longest, size, saved, retries) in sorted(summary.items(),
+                                                                                  key=lambda x: -x[1][1]):
+        api = category == "api"
+        rows.append([name, count, "%.1f" % (total / 1000), "%.1f" % (longest / 1000),
+                     size if api else "", saved if api else "", retries if api else ""])
+    print("Memoized requests: %(hits)d hits, %(misses)d misses, %(coalesced)d coalesced" % account()["memo_stats"])
+    t = Texttable(max_width=0)
+    t.set_cols_align(["l", "r", "r", "r", "r", "r", "r"])
+    t.set_cols_dtype(["t", "i", "t", "t", "t", "t", "t"])
+    t.add_rows(rows)
+    print(t.draw())
+    print("Trace written to %s" % path)
+
+
+def api_endpoint(url):
+    if url.startswith(API_BASE):
+        url = url[len(API_BASE):]
+    return url.split("?")[0]
+
+
+def api_call(method, url, entry=None, **kwargs):
+    start = perf_counter()
+    stats = {"status": None, "bytes": 0, "saved": 0, "retries": 0}
+    try:
+        return send_api_request(method, url, stats, entry, **kwargs)
+    finally:
+        if method != 'GET':
+            # even a failed request may have changed something
+            account()["mutated"] = True
+            memo_invalidate(MEMO_INVALIDATIONS.get(api_endpoint(url), []))
+        trace_event("%s %s" % (method, api_endpoint(url)), "api", start, **stats)
+
+
+_rate_lock = threading.Lock()
+_rate_next = 0
+
+
+def rate_limit():
+    # spaces requests evenly, shared by every account in the process
+    global _rate_next
+    if not RATE_LIMIT:
+        return
+    with _rate_lock:
+        slot = max(perf_counter(), _rate_next)
+        _rate_next = slot + 1 / RATE_LIMIT
+    delay = slot - perf_counter()
+    if delay > 0:
+        sleep(delay)
+
+
+def send_api_request(method, url, stats, entry=None, **kwargs):
+    # entry is a cache entry, its validators make the request conditional and are updated from the response
+    import requests
+    if entry and (entry.get("etag") or entry.get("last_modified")):
+        headers = dict(kwargs.get("headers") or {})
+        if entry.get("etag"):
+            headers["if-none-match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["if-modified-since"] = entry["last_modified"]
+        kwargs["headers"] = headers
     if VERBOSE:
         print("API REQUEST: %s %s %s %s" % (method, url, kwargs.get("headers"), kwargs.get("json")))
-    response = requests.request(method, url, **kwargs)
+    kwargs.setdefault("timeout", (API_CONNECT_TIMEOUT, API_READ_TIMEOUT))
+    # only idempotent requests are safe to retry
+    attempts = API_RETRIES if method == 'GET' else 1
+    for attempt in range(attempts):
+        if attempt:
+            stats["retries"] = attempt
+            sleep(backoff_delay(attempt - 1))
+        rate_limit()
+        last_attempt = attempt + 1 == attempts
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if last_attempt:
+                raise
+            if VERBOSE:
+                print("API RETRY: %s %s %s" % (method, url, e))
+            continue
+        if response.status_code >= 500 and not last_attempt:
+            if VERBOSE:
+                print("API RETRY: %s %s %s" % (method, url, response.status_code))
+            continue
+        break
     status_code = response.status_code
+    stats["status"] = status_code
+    # what actually came over the wire, before decompression
+    content = response.content
+    stats["bytes"] = response.raw.tell() if hasattr(response.raw, "tell") else len(content)
+    stats["saved"] = max(0, len(content) - stats["bytes"])
     response_headers = response.headers
+    if status_code == 304 and entry:
+        stats["saved"] += entry.get("size", 0)
+        if VERBOSE:
+            print("API RESPONSE: 304 %s" % url)
+        return entry["body"]
     content_type = response_headers.get('Content-Type') or ''
     response_json = {}
     if content_type.startswith('application/json'):
         response_json = response.json()
     if VERBOSE:
         print("API RESPONSE: %s %s %s" % (status_code, response_headers, response_json))
+    if status_code == 200 and entry is not None:
+        entry["etag"] = response_headers.get("ETag")
+        entry["last_modified"] = response_headers.get("Last-Modified")
+        entry["size"] = len(content)
     if status_code != 200:
         if status_code == 400 and not response_json.get("success"):
-            raise ApiException(response_json.get("message"))
-        raise ApiException("%s %s %s %s %s %s" %
-                           (method, url, kwargs.get("headers"), status_code, response_headers, response_json))
+            raise ApiRejected(response_json.get("message"))
+        message = "%s %s %s %s %s %s" % (method, url, kwargs.get("headers"), status_code, response_headers,
+                                         response_json)
+        if status_code in (401, 403):
+            raise ApiUnauthorized(message)
+        raise ApiException(message)
     return response_json
 
 
-def get_token(refresh=False):
-    if not refresh and isfile(token_file):
-        with open(token_file) as f:
+def cache_entry_path(url):
+    return "%s/%s.json" % (account()["cache_path"], hashlib.sha1(url.encode()).hexdigest())
+
+
+def cache_read(url):
+    path = cache_entry_path(url)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+        # the modification time tracks recency for eviction
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    if entry.get("url") != url:
+        return None
+    return entry
+
+
+def cache_evict():
+    cache_path = account()["cache_path"]
+    entries = []
+    total = 0
+    for name in os.listdir(cache_path):
+        path = "%s/%s" % (cache_path, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def cache_write(url, body, entry=None):
+    os.makedirs(account()["cache_path"], exist_ok=True)
+    path = cache_entry_path(url)
+    tmp_path = "%s.%s.tmp" % (path, threading.get_ident())
+    with open(tmp_path, 'w') as f:
+        # keeps the validators of the entry
+        json.dump(dict(entry or {}, url=url, fetched=now(), body=body), f)
+    os.replace(tmp_path, path)
+    cache_evict()
+
+
+def cache_ttl(url):
+    for endpoint, ttl in CACHE_TTLS.items():
+        if url.startswith(API_BASE + endpoint):
+            return ttl
+    return None
+
+
+# (cache path, url) pairs, since every account has its own cache
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+
+def revalidate(url, entry, **kwargs):
+    key = (account()["cache_path"], url)
+    with _revalidating_lock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+
+    def target():
+        try:
+            validators = dict(entry)
+            cache_write(url, api_call('GET', url, entry=validators, **kwargs), validators)
+        except Exception as e:
+            if VERBOSE:
+                print("CACHE REVALIDATE FAILED: %s %s" % (url, e))
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(key)
+
+    threading.Thread(target=copy_context().run, args=(target,)).start()
+
+
+def disk_cached_api_call(method, url, **kwargs):
+    ttl = cache_ttl(url)
+    conditional = any(api_endpoint(url).startswith(x) for x in CONDITIONAL_ENDPOINTS)
+    if NO_CACHE or method != 'GET' or not (ttl or conditional):
+        return api_call(method, url, **kwargs)
+    entry = cache_read(url)
+    if entry and ttl:
+        fresh, stale = ttl
+        age = now() - entry["fetched"]
+        if VERBOSE:
+            print("CACHE HIT: %s age=%ds" % (url, age))
+        if age < fresh:
+            return entry["body"]
+        if age < fresh + stale:
+            revalidate(url, entry, **kwargs)
+            return entry["body"]
+    entry = entry or {}
+    previous = entry.get("body")
+    body = api_call(method, url, entry=entry, **kwargs)
+    # without validators there is nothing to revalidate next time
+    if ttl or (body is not previous and (entry.get("etag") or entry.get("last_modified"))):
+        cache_write(url, body, entry)
+    return body
+
+
+_memo_lock = threading.Lock()
+
+
+def memo_invalidate(endpoints):
+    if not endpoints:
+        return
+    current = account()
+    memo = current["memo"]
+    with _memo_lock:
+        # requests still in flight must not store what may now be stale
+        current["memo_generation"] += 1
+        for url in list(memo):
+            if any(api_endpoint(url).startswith(x) for x in endpoints):
+                del memo[url]
+
+
+def cached_api_call(method, url, fresh=False, **kwargs):
+    endpoint = api_endpoint(url)
+    if method != 'GET' or fresh or not any(endpoint.startswith(x) for x in MEMO_ENDPOINTS):
+        return disk_cached_api_call(method, url, **kwargs)
+    current = account()
+    memo = current["memo"]
+    inflight = current["memo_inflight"]
+    with _memo_lock:
+        if url in memo:
+            current["memo_stats"]["hits"] += 1
+            return copy.deepcopy(memo[url])
+        future = inflight.get(url)
+        leader = future is None
+        if leader:
+            current["memo_stats"]["misses"] += 1
+            future = Future()
+            inflight[url] = future
+            generation = current["memo_generation"]
+        else:
+            current["memo_stats"]["coalesced"] += 1
+    if not leader:
+        # an identical request is already on its way
+        return copy.deepcopy(future.result())
+    try:
+        body = disk_cached_api_call(method, url, **kwargs)
+    except BaseException as e:
+        with _memo_lock:
+            del inflight[url]
+        future.set_exception(e)
+        raise
+    with _memo_lock:
+        del inflight[url]
+        if generation == current["memo_generation"]:
+            memo[url] = body
+    future.set_result(body)
+    return copy.deepcopy(body)
+
+
+def read_token():
+    current = account()
+    try:
+        with open(current["token_file"]) as f:
             token = f.read().rstrip()
-            if token:
-                return token
-    print("Loading auth flow in standalone Chrome...")
-    if exists("/usr/local/bin/chromedriver") or exists("/usr/bin/chromedriver"):
-        print("NOTE: If you get the alert with 'chromedriver cannot be opened because the developer cannot be verified.', "
-              "select 'Cancel' to proceed.")
-    print("PROTIP: Enable 'Remember Me' and 'Keep me signed in' and 'Trusted Device' to speed up subsequent logins.")
-    sleep(1)
+    except OSError:
+        return None, None
+    try:
+        with open(current["token_meta_file"]) as f:
+            expires = json.load(f).get("expires")
+    except (OSError, ValueError):
+        expires = None
+    return token or None, expires
+
+
+def token_expiring(expires):
+    return expires is not None and now() > expires - TOKEN_REFRESH_MARGIN
+
+
+def browser_login(headless):
+    # selenium is slow to import and only needed for a browser login
+    from selenium import webdriver
+    from selenium.common.exceptions import WebDriverException
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+    if not headless:
+        print("Loading auth flow in standalone Chrome...")
+        if exists("/usr/local/bin/chromedriver") or exists("/usr/bin/chromedriver"):
+            print("NOTE: If you get the alert with 'chromedriver cannot be opened because the developer cannot be "
+                  "verified.', select 'Cancel' to proceed.")
+        print("PROTIP: Enable 'Remember Me' and 'Keep me signed in' and 'Trusted Device' to speed up subsequent "
+              "logins.")
+        sleep(1)
     chrome_options = Options()
-    chrome_options.add_argument("user-data-dir=%s/selenium" % config_path)
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get("https://login.sequoia.com/?redirect=https://px.sequoia.com/workplace/")
+    chrome_options.add_argument("user-data-dir=%s/selenium" % account()["config_path"])
+    if headless:
+        chrome_options.add_argument("--headless=new")
     try:
-        WebDriverWait(driver, 300).until(EC.url_to_be("https://px.sequoia.com/workplace/"))
+        driver = webdriver.Chrome(options=chrome_options)
+    except WebDriverException as e:
+        if not headless:
+            raise
+        if VERBOSE:
+            print("HEADLESS LOGIN FAILED: %s" % e)
+        return None, None
+    try:
+        driver.get("https://login.sequoia.com/?redirect=https://px.sequoia.com/workplace/")
+        if headless:
+            settled = perf_counter() + HEADLESS_LOGIN_SETTLE
+
+            def landed(driver):
+                url = driver.current_url
+                # still on the login form after a remembered login would have redirected, so nobody is coming
+                if url.startswith("https://login.sequoia.com/") and perf_counter() > settled:
+                    return url
+                return url == "https://px.sequoia.com/workplace/" and url
+
+            try:
+                url = WebDriverWait(driver, HEADLESS_LOGIN_WAIT).until(landed)
+            except WebDriverException as e:
+                url = e
+            if url != "https://px.sequoia.com/workplace/":
+                # the login needs someone at the keyboard
+                if VERBOSE:
+                    print("HEADLESS LOGIN FAILED: %s" % url)
+                return None, None
+        else:
+            WebDriverWait(driver, LOGIN_WAIT).until(EC.url_to_be("https://px.sequoia.com/workplace/"))
         cookies = driver.get_cookies()
         if VERBOSE:
             print("COOKIES", cookies)
         for cookie in cookies:
             if cookie["name"] == "_sc":
-                token = json.loads(unquote(cookie["value"]))["sessionToken"]
-                with open(token_file, 'w') as f:
-                    f.write(token)
-                return token
+                return json.loads(unquote(cookie["value"]))["sessionToken"], cookie.get("expiry")
+        if headless:
+            if VERBOSE:
+                print("HEADLESS LOGIN FAILED: no session cookie")
+            return None, None
         raise ApiException("Failed to fetch token")
     finally:
         driver.quit()
 
 
-def get_config():
+def token_usable(token, expires):
+    if not token:
+        return False
+    if not token_expiring(expires):
+        return True
+    # still good for a few minutes, so only bother someone once it has actually expired
+    return account()["token_deferred"] and now() < expires
+
+
+def get_token(refresh=False, headless=True):
+    if not refresh:
+        token, expires = read_token()
+        if token_usable(token, expires):
+            return token
+    current = account()
+    with current["token_lock"]:
+        stale_token = stale_expires = None
+        if not refresh:
+            # another thread may have logged in while this one waited
+            token, expires = read_token()
+            if token_usable(token, expires):
+                return token
+            if VERBOSE and token:
+                print("TOKEN EXPIRING: refreshing ahead of time")
+            stale_token, stale_expires = token, expires
+        token = expires = None
+        # without a profile left by an earlier login there is nothing for a headless browser to remember
+        if headless and isdir("%s/selenium" % current["config_path"]):
+            token, expires = browser_login(True)
+        if not token:
+            if stale_token and now() < stale_expires:
+                current["token_deferred"] = True
+                return stale_token
+            if current["unattended"]:
+                raise ApiUnauthorized("Login needed, run wawona interactively")
+            token, expires = browser_login(False)
+        current["token_deferred"] = False
+        with open(current["token_file"], 'w') as f:
+            f.write(token)
+        with open(current["token_meta_file"], 'w') as f:
+            json.dump({"expires": expires}, f)
+        return token
+
+
+def refresh_token(stale_token):
+    # concurrent callers failing with the same token should only trigger one login
+    with account()["token_lock"]:
+        token = get_token()
+        if token != stale_token:
+            return token
+        return get_token(True)
+
+
+def call_with_token(token, fn, *args):
+    try:
+        return fn(token, *args)
+    except ApiUnauthorized:
+        return fn(refresh_token(token), *args)
+
+
+def read_config():
     config: dict[str, str] = {}
+    config_file = account()["config_file"]
     if isfile(config_file):
         with open(config_file) as f:
             config = json.load(f)
+    return config
+
+
+def is_configured(config):
+    return CONFIG_VERSION == int(config.get("version", "0"))
+
+
+def save_config(config):
+    with open(account()["config_file"], 'w') as f:
+        json.dump(config, f)
+
+
+def get_config():
+    import inquirer
+    config = read_config()
+    config_path = account()["config_path"]
     if not isdir(config_path):
         os.makedirs(config_path, exist_ok=True)
-    if CONFIG_VERSION == int(config.get("version", "0")):
+    if is_configured(config):
         return config
     config["version"] = str(CONFIG_VERSION)
     hours = []
@@ -147,23 +736,171 @@ def get_config():
     ]
     answers = inquirer.prompt(questions)
     config.update(answers)
-    # test configuration
-    get_token(True)
+    # test configuration, which is a first login that needs someone at the keyboard
+    get_token(True, headless=False)
     # only persist configuration if test worked
-    with open(config_file, 'w') as f:
-        json.dump(config, f)
+    save_config(config)
     return config
 
 
 def token_headers(token):
-    headers = {"token": token}
-    headers.update(HEADERS)
-    return headers
+    # the static HEADERS are set once on the shared session
+    return {"token": token}
+
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (day TEXT PRIMARY KEY, space TEXT, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS followings (name TEXT NOT NULL, day TEXT NOT NULL, updated REAL NOT NULL,
+                                       PRIMARY KEY (name, day)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS followings_day ON followings (day);
+CREATE TABLE IF NOT EXISTS fetched (kind TEXT NOT NULL, day TEXT NOT NULL, updated REAL NOT NULL,
+                                    PRIMARY KEY (kind, day)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS floors (floor_id TEXT PRIMARY KEY, name TEXT, data TEXT NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS spaces (unique_space_id TEXT PRIMARY KEY, floor_id TEXT NOT NULL, space_id TEXT,
+                                   label TEXT, x REAL, y REAL, updated REAL NOT NULL);
+"""
+
+_state_lock = threading.Lock()
+
+
+@contextmanager
+def state_db():
+    # the store is a convenience, so failing to use it never fails the run
+    import sqlite3
+    current = account()
+    with _state_lock:
+        if current["state"] is None:
+            db = None
+            try:
+                os.makedirs(current["config_path"], exist_ok=True)
+                db = sqlite3.connect(current["state_file"], check_same_thread=False)
+                db.executescript(STATE_SCHEMA)
+                current["state"] = db
+            except (sqlite3.Error, OSError) as e:
+                if VERBOSE:
+                    print("STATE FAILED: %s" % e)
+                if db is not None:
+                    db.close()
+                # don't retry on every fetch of this run
+                current["state"] = False
+        if not current["state"]:
+            yield None
+            return
+        try:
+            with current["state"]:
+                yield current["state"]
+        except (sqlite3.Error, OSError) as e:
+            if VERBOSE:
+                print("STATE FAILED: %s" % e)
+
+
+def day_range(start, end):
+    return [(start + timedelta(days=x)).isoformat() for x in range((end - start).days)]
+
+
+def store_summary(start, end, booked):
+    # a summary is a snapshot of its range, so days missing from it are no longer booked
+    days = day_range(start, end)
+    booked = {x.isoformat() for x in booked}
+    updated = now()
+    with state_db() as db:
+        if db is None:
+            return
+        db.executemany("DELETE FROM bookings WHERE day = ?", [(x,) for x in days if x not in booked])
+        db.executemany("INSERT INTO bookings (day, updated) VALUES (?, ?) "
+                       "ON CONFLICT (day) DO UPDATE SET updated = excluded.updated",
+                       [(x, updated) for x in days if x in booked])
+        db.executemany("INSERT OR REPLACE INTO fetched VALUES ('summary', ?, ?)", [(x, updated) for x in days])
+
+
+def store_booking(day, space):
+    with state_db() as db:
+        if db is None:
+            return
+        db.execute("INSERT OR REPLACE INTO bookings VALUES (?, ?, ?)", (day, space, now()))
+
+
+def store_followings(start, end, names, masks):
+    days = day_range(start, end)
+    updated = now()
+    rows = []
+    for name, mask in zip(names, masks):
+        rows.extend((name, day, updated) for x, day in enumerate(days) if mask >> x & 1)
+    with state_db() as db:
+        if db is None:
+            return
+        db.execute("DELETE FROM followings WHERE day >= ? AND day < ?", (start.isoformat(), end.isoformat()))
+        db.executemany("INSERT INTO followings VALUES (?, ?, ?)", rows)
+        db.executemany("INSERT OR REPLACE INTO fetched VALUES ('followings', ?, ?)", [(x, updated) for x in days])
+
+
+def store_floors(floors):
+    updated = now()
+    with state_db() as db:
+        if db is None:
+            return
+        db.executemany("INSERT OR REPLACE INTO floors VALUES (?, ?, ?, ?)",
+                       [(x["floorId"], x.get("floorName"), json.dumps(x), updated) for x in floors])
+
+
+def store_spaces(floor_id, spaces):
+    updated = now()
+    with state_db() as db:
+        if db is None:
+            return
+        db.executemany("INSERT OR REPLACE INTO spaces VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       [(x["uniqueSpaceId"], floor_id, x.get("spaceId"), x.get("label"), x.get("Rx"), x.get("Ry"),
+                         updated) for x in spaces])
+
+
+def load_week(week):
+    # the saved counterpart of get_summary and get_followings for one week
+    start, end = week[0].isoformat(), (week[0] + timedelta(days=7)).isoformat()
+    booked = set()
+    spaces = {}
+    names = {}
+    masks = array("Q")
+    updated = None
+    with state_db() as db:
+        if db is None:
+            return booked, spaces, (names, masks), updated
+        for day, space in db.execute("SELECT day, space FROM bookings WHERE day >= ? AND day < ?", (start, end)):
+            booked.add(date.fromisoformat(day))
+            if space:
+                spaces[day] = space
+        bits = day_bits(week[0], week[0] + timedelta(days=7))
+        for name, day in db.execute("SELECT name, day FROM followings WHERE day >= ? AND day < ? ORDER BY name",
+                                    (start, end)):
+            row = names.setdefault(name, len(masks))
+            if row == len(masks):
+                masks.append(0)
+            masks[row] |= bits[day]
+        updated = db.execute("SELECT min(updated) FROM fetched WHERE day >= ? AND day < ?", (start, end)).fetchone()[0]
+    return booked, spaces, (names, masks), updated
+
+
+def usual_days(name):
+    # weekday -> (days in the office, days we know about)
+    out = {}
+    with state_db() as db:
+        if db is None:
+            return out
+        if name == YOU:
+            seen = dict(db.execute("SELECT strftime('%w', day), count(*) FROM fetched WHERE kind = 'summary' "
+                                   "GROUP BY 1"))
+            rows = db.execute("SELECT ?, strftime('%w', day), count(*) FROM bookings GROUP BY 2", (YOU,))
+        else:
+            seen = dict(db.execute("SELECT strftime('%w', day), count(*) FROM fetched WHERE kind = 'followings' "
+                                   "GROUP BY 1"))
+            rows = db.execute("SELECT name, strftime('%w', day), count(*) FROM followings "
+                              "WHERE name LIKE '%' || ? || '%' GROUP BY 1, 2 ORDER BY 1", (name,))
+        for full_name, weekday, count in rows:
+            out.setdefault(full_name, {})[int(weekday)] = (count, max(count, seen.get(weekday, 0)))
+    return out
 
 
 def get_locations(token):
-    response = api_call(
-        method='GET', url="https://hrx-backend.sequoia.com/rtw/resv/client/locations", headers=token_headers(token))
+    response = cached_api_call(method='GET', url=API_BASE + "resv/client/locations", headers=token_headers(token))
     return [(x["locationName"], x) for x in response["data"]["locations"]]
 
 
@@ -177,74 +914,134 @@ def parse_date(dt):
 
 
 def get_summary(token, start, end):
-    response = api_call(method='GET',
-                        url="https://hrx-backend.sequoia.com/rtw/client/dashboard/summary?statStart=%s&statEnd=%s" % (
-                            format_date(start), format_date(end)), headers=token_headers(token))
+    response = cached_api_call(method='GET',
+                               url=API_BASE + "client/dashboard/summary?statStart=%s&statEnd=%s" % (
+                                   format_date(start), format_date(end)), headers=token_headers(token))
     out = set()
     for stat in response["data"]["weeklyStats"]:
         out.add(parse_date(stat["date"]))
+    store_summary(start, end, out)
     return out
 
 
+@lru_cache(maxsize=64)
+def day_bits(start, end):
+    # "YYYY-MM-DD" -> bit of that day, counted from start
+    return {(start + timedelta(days=x)).isoformat(): 1 << x for x in range((end - start).days + 1)}
+
+
 def get_followings(token, start, end):
-    response = api_call(method='GET',
-                        url="https://hrx-backend.sequoia.com/rtw/client/followings?startDate=%s&endDate=%s" % (
-                            format_date(start), format_date(end)), headers=token_headers(token))
-    out = {}
-    followings = response["data"]["followings"]
-    if not followings:
-        print("You are not following any coworkers.\n"
-              "Add them in https://px.sequoia.com/workplace or the app, and they will appear calendar below.")
-    for user in followings:
-        name = user["fullName"]
-        reservations = user.get("reservationsMetadata", [])
-        days = set()
-        out[name] = days
-        if reservations:
-            for reservation in reservations:
-                year, month, day = reservation["reservationStartTime"].split(" ")[0].split("-")
-                dt = date(int(year), int(month), int(day))
-                days.add(dt)
-    return out
+    response = cached_api_call(method='GET',
+                               url=API_BASE + "client/followings?startDate=%s&endDate=%s" % (
+                                   format_date(start), format_date(end)), headers=token_headers(token))
+    # name -> row, and one bitmask of reserved days per row
+    bits = day_bits(start, end)
+    names = {}
+    masks = array("Q") if len(bits) <= 64 else []
+    for user in response["data"]["followings"]:
+        mask = 0
+        for reservation in user.get("reservationsMetadata") or ():
+            mask |= bits.get(reservation["reservationStartTime"][:10], 0)
+        row = names.setdefault(user["fullName"], len(masks))
+        if row == len(masks):
+            masks.append(mask)
+        else:
+            masks[row] |= mask
+    store_followings(start, end, names, masks)
+    return names, masks
 
 
 def pretty_time(dt):
+    import pytz
     return dt.astimezone(pytz.utc).isoformat().replace('+00:00', 'Z')
 
 
-def add_reservations(token, location, dates, config):
-    body = {
-        "reservationType": "LOCATION",
-        "locationId": location["locationId"],
-        "reservations": []
-    }
+def submit_reservation(token, location, day, reservation):
+    for attempt in range(RESERVATION_ATTEMPTS):
+        if attempt:
+            sleep(backoff_delay(attempt - 1))
+            # the previous attempt may have gone through with only its response lost
+            if day in get_summary(token, day, day + timedelta(days=1)):
+                return set()
+        try:
+            response = api_call(
+                method='POST', url=API_BASE + "resv/client/reservations",
+                headers=token_headers(token),
+                json={
+                    "reservationType": "LOCATION",
+                    "locationId": location["locationId"],
+                    "reservations": [reservation]
+                })
+            return get_reservation_ids(response)
+        except ApiRejected:
+            raise
+        except (ApiException, OSError) as e:
+            if VERBOSE:
+                print("RESERVATION RETRY: %s %s" % (day, e))
+            if attempt + 1 == RESERVATION_ATTEMPTS:
+                raise
+
+
+def add_reservations(token, location, dates, config, booked=None):
+    # every day is reserved on its own, so one rejected day does not take the others down with it
+    import pytz
     tz = pytz.timezone(location["locationTimezone"])
     # the earliest start will be the top of the next hour
     min_start = (datetime.now(tz) + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
     check_tasks = False
-    for day in dates:
-        start = tz.localize(datetime.combine(day, time(int(config["start_hour"]))))
-        if start <= min_start:
-            start = min_start
-            # make sure we wait for pending tasks since we are close enough to the start of the reservation
-            check_tasks = True
-        # the end needs to be a minute before the end start of the last hour
-        end = tz.localize(datetime.combine(day, time(int(config["end_hour"]))) - timedelta(minutes=1))
-        if start < end:
-            body['reservations'].append({
+    results = {}
+    reservation_ids = set()
+    with ContextExecutor(max_workers=TASK_WORKERS) as executor:
+        submissions = {}
+        for day in dates:
+            start = tz.localize(datetime.combine(day, time(int(config["start_hour"]))))
+            close = start <= min_start
+            if close:
+                start = min_start
+            # the end needs to be a minute before the end start of the last hour
+            end = tz.localize(datetime.combine(day, time(int(config["end_hour"]))) - timedelta(minutes=1))
+            if start >= end:
+                results[day] = "too late in the day"
+                continue
+            reservation = {
                 "startTimeUtc": pretty_time(start),
                 "endTimeUtc": pretty_time(end),
                 "isPrivate": False
-            })
-    if body['reservations']:
-        api_call(
-            method='POST', url="https://hrx-backend.sequoia.com/rtw/resv/client/reservations",
-            headers=token_headers(token),
-            json=body)
-    return check_tasks
+            }
+            submissions[executor.submit(submit_reservation, token, location, day, reservation)] = (day, close)
+        for future in as_completed(submissions):
+            day, close = submissions[future]
+            try:
+                reservation_ids |= future.result()
+            except (ApiException, OSError) as e:
+                results[day] = str(e) or type(e).__name__
+                continue
+            results[day] = None
+            # make sure we wait for pending tasks since we are close enough to the start of the reservation
+            check_tasks = check_tasks or close
+    if booked is not None:
+        # optimistically show the new days without waiting for the summary
+        booked.update(day for day, error in results.items() if not error)
+    return check_tasks, reservation_ids, results
+
+
+def print_reservation_failures(results):
+    for day, error in sorted(results.items()):
+        if error:
+            print("\033[31mFailed\033[0m to reserve %s: %s" % (day.strftime('%a %d %b'), error))
+
+
+def get_reservation_ids(response):
+    data = response.get("data")
+    if isinstance(data, dict):
+        data = data.get("reservations")
+    if not isinstance(data, list):
+        return set()
+    return {x["reservationId"] for x in data if isinstance(x, dict) and x.get("reservationId")}
 
 
 def do_inquiry(message, choices, default=None):
+    import inquirer
     if len(choices) == 0:
         raise Exception("No choices")
     if len(choices) == 1:
@@ -259,53 +1056,156 @@ def do_inquiry(message, choices, default=None):
             default=default
         ),
     ]
-    answers = inquirer.prompt(questions)
+    with phase("prompt"):
+        answers = inquirer.prompt(questions)
     if not answers:
         raise Exception("No choice")
     return answers['choice']
 
 
 def get_pending_tasks(token):
-    response = api_call(method='GET', url="https://hrx-backend.sequoia.com/rtw/client/pending-task",
+    response = api_call(method='GET', url=API_BASE + "client/pending-task",
                         headers=token_headers(token))
     return [x["taskId"] for x in response["data"]["tasks"]]
 
 
+def reconcile_booked(booked, actual):
+    missing = sorted(booked - actual)
+    if missing:
+        print("\033[33mWarning:\033[0m not reserved according to the server: %s" %
+              ", ".join(x.strftime('%a %d %b') for x in missing))
+    unexpected = sorted(actual - booked)
+    if unexpected:
+        print("\033[33mWarning:\033[0m also reserved according to the server: %s" %
+              ", ".join(x.strftime('%a %d %b') for x in unexpected))
+
+
+def wait_for_tasks(token, reservation_ids, known_task_ids, deadline):
+    # poll with exponential backoff until a task for one of the new reservations shows up
+    give_up = now() + deadline
+    delay = TASK_POLL_INITIAL_DELAY
+    checked = set(known_task_ids)
+    while True:
+        remaining = give_up - now()
+        if remaining <= 0:
+            return []
+        sleep(min(remaining, random.uniform(delay / 2, delay)))
+        delay = min(TASK_POLL_MAX_DELAY, delay * 2)
+        new_task_ids = [x for x in get_pending_tasks(token) if x not in checked]
+        if not reservation_ids:
+            # nothing to match against, so any new task will do
+            if new_task_ids:
+                return new_task_ids
+            continue
+        found = []
+        for task_id in new_task_ids:
+            checked.add(task_id)
+            if get_task(token, task_id).get("reservationId") in reservation_ids:
+                found.append(task_id)
+        if found:
+            return found
+
+
 def get_task(token, task_id):
-    response = api_call(method='GET',
-                        url="https://hrx-backend.sequoia.com/rtw/client/task/info?taskId=%s" % task_id,
-                        headers=token_headers(token))
+    response = cached_api_call(method='GET',
+                               url=API_BASE + "client/task/info?taskId=%s" % task_id,
+                               headers=token_headers(token))
     return response["data"]
 
 
 def respond_to_task(token, task_id, answers):
-    api_call(method='POST', url="https://hrx-backend.sequoia.com/rtw/client/task-response",
+    api_call(method='POST', url=API_BASE + "client/task-response",
              headers=token_headers(token),
              json={"taskId": task_id, "response": answers})
 
 
 def get_floors(token, task_id):
-    response = api_call(
-        method='GET', url="https://hrx-backend.sequoia.com/rtw/client/space-bookings/floors?taskId=%s" % task_id,
-        headers=token_headers(token))
-    return [(x["floorName"], x) for x in response["data"]["floors"] if x["status"] == "active"]
+    response = cached_api_call(method='GET', url=API_BASE + "client/space-bookings/floors?taskId=%s" % task_id,
+                               headers=token_headers(token))
+    floors = response["data"]["floors"]
+    store_floors(floors)
+    return [(x["floorName"], x) for x in floors if x["status"] == "active"]
 
 
-def get_spaces(token, adjective, task_id, floor_id, start_time, end_time):
-    url = ("https://hrx-backend.sequoia.com/rtw/client/space-bookings/%s/spaces?taskId=%s&floorId=%s&startTime=%s"
+def get_spaces(token, adjective, task_id, floor_id, start_time, end_time, fresh=False):
+    url = (API_BASE + "client/space-bookings/%s/spaces?taskId=%s&floorId=%s&startTime=%s"
            "&endTime=%s") % (
               adjective, task_id, floor_id, start_time, end_time)
-    response = api_call(method='GET', url=url, headers=token_headers(token))
-    return response["data"]["spaces"] or []
+    response = cached_api_call(method='GET', url=url, fresh=fresh, headers=token_headers(token))
+    spaces = response["data"]["spaces"] or []
+    store_spaces(floor_id, spaces)
+    return spaces
 
 
 def reserve_space(token, task_id, start_time, end_time, space_id, user_id, reservation_id):
-    response = api_call(method='POST', url="https://hrx-backend.sequoia.com/rtw/client/space-bookings/space",
+    response = api_call(method='POST', url=API_BASE + "client/space-bookings/space",
                         headers=token_headers(token),
                         json={"taskId": task_id, "startTime": start_time, "endTime": end_time, "spaceId": space_id,
                               "userId": user_id, "reservationId": reservation_id}
                         )
-    return response["data"]["label"]
+    label = response["data"]["label"]
+    store_booking(start_time[:10], label)
+    return label
+
+
+_floor_projections = {}
+_floor_projections_lock = threading.Lock()
+
+
+def project_floor(floor, spaces, cols):
+    # the layout of a floor does not change within a run, so its projection is computed once per width
+    key = (floor.get("floorId"), cols, frozenset(x["uniqueSpaceId"] for x in spaces))
+    with _floor_projections_lock:
+        projection = _floor_projections.get(key)
+    if projection:
+        return projection
+    min_x = min(x['Rx'] for x in spaces)
+    max_x = max(x['Rx'] for x in spaces)
+    min_y = min(x['Ry'] for x in spaces)
+    max_y = max(x['Ry'] for x in spaces)
+    new_width = max(max_x - min_x, 1)
+    new_height = max(max_y - min_y, 1)
+    rows = max(1, round(cols * (new_height / new_width) * TERMINAL_CHAR_ASPECT_RATIO))
+    positions = {}
+    for space in spaces:
+        x = round((space['Rx'] - min_x) / new_width * (cols - 1))
+        y = round((space['Ry'] - min_y) / new_height * (rows * 2 - 1))
+        positions[space["uniqueSpaceId"]] = (x, y)
+    projection = (cols, rows, positions)
+    with _floor_projections_lock:
+        _floor_projections[key] = projection
+    return projection
+
+
+def render_floor_plan(cols, rows, positions, spaces):
+    pixels = {}
+    for space in sorted(spaces, key=lambda x: (COLOR_PRIORITY.index(x['color']), natural_key(x["label"]))):
+        pixels.setdefault(positions[space["uniqueSpaceId"]], space['color'])
+    lines = []
+    for row in range(rows):
+        line = []
+        current_style = None
+        for col in range(cols):
+            top = pixels.get((col, row * 2))
+            bottom = pixels.get((col, row * 2 + 1))
+            if top is None and bottom is None:
+                style, glyph = "0", " "
+            elif bottom is None:
+                style, glyph = "0;%s" % top, UPPER_HALF
+            elif top is None:
+                style, glyph = "0;%s" % bottom, LOWER_HALF
+            elif top == bottom:
+                style, glyph = "0;%s" % top, FULL_BLOCK
+            else:
+                style, glyph = "0;%s;%d" % (top, int(bottom) + 10), UPPER_HALF
+            # only switch colors when they actually change
+            if style != current_style:
+                line.append("\033[%sm" % style)
+                current_style = style
+            line.append(glyph)
+        line.append("\033[0m")
+        lines.append("".join(line))
+    return lines
 
 
 def draw_floor_plan(floor, spaces):
@@ -314,59 +1214,203 @@ def draw_floor_plan(floor, spaces):
     spaces = [x for x in spaces if 'Rx' in x]
     if not spaces:
         return
+    cols = min(FLOOR_PLAN_COLS, shutil.get_terminal_size((FLOOR_PLAN_COLS, 24))[0]) - FLOOR_PLAN_BUFFER
+    cols, rows, positions = project_floor(floor, spaces, cols)
+    lines = render_floor_plan(cols, rows, positions, spaces)
+    lines.append(
+        "\033[%sm%s\033[0m preferred    "
+        "\033[%sm%s\033[0m free    "
+        "\033[%sm%s\033[0m booked by someone you are following    "
+        "\033[%sm%s\033[0m booked" % (
+            COLOR_PREFERRED, FULL_BLOCK, COLOR_AVAILABLE, FULL_BLOCK, COLOR_BOOKED_FOLLOWING, FULL_BLOCK,
+            COLOR_BOOKED, FULL_BLOCK))
+    # a single write, rather than one per row
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
 
-    base_width = floor['baseWidth']
-    aspect_ratio = floor["aspectRatio"]
-    base_height = round(base_width * aspect_ratio)
 
-    min_x = base_width
-    min_y = base_height
-    max_x = 0
-    max_y = 0
-    for space in spaces:
-        x = space['Rx']
-        min_x = min(min_x, x)
-        max_x = max(max_x, x)
-        y = space['Ry']
-        min_y = min(min_y, y)
-        max_y = max(max_y, y)
+def get_prefetched_spaces(token, adjective, task, floor_id, prefetched):
+    future = prefetched.get(adjective) if prefetched else None
+    if future:
+        return future.result()
+    return get_spaces(token, adjective, task["taskId"], floor_id, task["reservationStartTime"],
+                      task["reservationEndTime"])
+
 
-    new_width = (max_x - min_x)
-    new_height = (max_y - min_y)
+@lru_cache(maxsize=None)
+def natural_key(label):
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', label)]
 
-    w = min(FLOOR_PLAN_COLS, os.get_terminal_size()[0]) - FLOOR_PLAN_BUFFER
-    h = round(w * (new_height / new_width) * TERMINAL_CHAR_ASPECT_RATIO)
 
-    grid = []
-    for _ in range(h + FLOOR_PLAN_BUFFER):
-        grid.append([" "] * (w + FLOOR_PLAN_BUFFER))
+_space_indexes = {}
+_space_indexes_lock = threading.Lock()
 
+
+def build_space_index(spaces):
+    # uniform grid buckets, sized for a handful of spaces per cell
+    spaces = [x for x in spaces if 'Rx' in x]
+    if not spaces:
+        return None
+    min_x = min(x['Rx'] for x in spaces)
+    max_x = max(x['Rx'] for x in spaces)
+    min_y = min(x['Ry'] for x in spaces)
+    max_y = max(x['Ry'] for x in spaces)
+    cell = max(1.0, ((max_x - min_x + 1) * (max_y - min_y + 1) * 4 / len(spaces)) ** 0.5)
+    buckets = {}
     for space in spaces:
-        x = round((space['Rx'] - min_x) / new_width * w)
-        y = round((space['Ry'] - min_y) / new_height * h)
-        color = space['color']
-        grid[y][x] = "\033[%sm%s\033[0m" % (color, DOT)
-
-    for row in grid:
-        print("".join(row))
-    print(
-        "\033[%sm%s\033[0m preferred    "
-        "\033[%sm%s\033[0m free    "
-        "\033[%sm%s\033[0m booked by someone you are following    "
-        "\033[%sm%s\033[0m booked" % (
-            COLOR_PREFERRED, DOT, COLOR_AVAILABLE, DOT, COLOR_BOOKED_FOLLOWING, DOT, COLOR_BOOKED, DOT))
+        buckets.setdefault((int(space['Rx'] // cell), int(space['Ry'] // cell)), []).append(space)
+    return {
+        "cell": cell,
+        "buckets": buckets,
+        "bounds": (int(min_x // cell), int(min_y // cell), int(max_x // cell), int(max_y // cell)),
+    }
 
 
-def get_space(token, task, floor, config, followings):
+def get_space_index(floor, spaces):
+    # the coordinates do not change, so an index is kept per floor and only rebuilt when new spaces show up
     floor_id = floor["floorId"]
-    task_id = task["taskId"]
-    start_time = task["reservationStartTime"]
-    end_time = task["reservationEndTime"]
-    available_spaces = get_spaces(token, "available", task_id, floor_id, start_time, end_time)
+    unique_space_ids = frozenset(x["uniqueSpaceId"] for x in spaces)
+    with _space_indexes_lock:
+        cached = _space_indexes.get(floor_id)
+        if cached and unique_space_ids <= cached[0]:
+            return cached[1]
+        index = build_space_index(spaces)
+        _space_indexes[floor_id] = (unique_space_ids, index)
+        return index
+
+
+def spaces_within(index, x, y, radius, accept=None):
+    if not index:
+        return []
+    cell = index["cell"]
+    out = []
+    for cx in range(int((x - radius) // cell), int((x + radius) // cell) + 1):
+        for cy in range(int((y - radius) // cell), int((y + radius) // cell) + 1):
+            for space in index["buckets"].get((cx, cy), ()):
+                if hypot(space['Rx'] - x, space['Ry'] - y) <= radius and (not accept or accept(space)):
+                    out.append(space)
+    return out
+
+
+def nearest_space(index, x, y, accept=None):
+    if not index:
+        return None
+    cell = index["cell"]
+    buckets = index["buckets"]
+    min_cx, min_cy, max_cx, max_cy = index["bounds"]
+    cx = int(x // cell)
+    cy = int(y // cell)
+    rings = max(cx - min_cx, max_cx - cx, cy - min_cy, max_cy - cy, 0)
+    best = None
+    best_distance = inf
+    for ring in range(rings + 1):
+        # nothing in this ring or beyond can be closer
+        if best_distance <= (ring - 1) * cell:
+            break
+        for dx in range(-ring, ring + 1):
+            for dy in range(-ring, ring + 1):
+                if max(abs(dx), abs(dy)) != ring:
+                    continue
+                for space in buckets.get((cx + dx, cy + dy), ()):
+                    distance = hypot(space['Rx'] - x, space['Ry'] - y)
+                    if distance < best_distance and (not accept or accept(space)):
+                        best = space
+                        best_distance = distance
+    return best
+
+
+def get_floor_occupancy(floor, available_spaces, booked_spaces, followings):
+    coworkers = []
+    for booked_space in booked_spaces:
+        full_name = "%s %s" % (booked_space.get("firstName"), booked_space.get("lastName"))
+        if full_name in followings:
+            coworkers.append((full_name, booked_space))
+    radius = NEAR_RADIUS_RATIO * floor.get("baseWidth", 0)
+    index = get_space_index(floor, available_spaces + booked_spaces)
+    available_space_ids = set(x["uniqueSpaceId"] for x in available_spaces)
+    near = set()
+    for _, seat in coworkers:
+        if 'Rx' in seat:
+            near.update(x["uniqueSpaceId"] for x in spaces_within(
+                index, seat['Rx'], seat['Ry'], radius, lambda x: x["uniqueSpaceId"] in available_space_ids))
+    return {
+        "floor": floor,
+        "free": len(available_spaces),
+        "booked": len(booked_spaces),
+        "near": len(near),
+        "coworkers": sorted(set(x for x, _ in coworkers)),
+    }
+
+
+def scan_floors(token, task, floors, spaces, followings):
+    from texttable import Texttable
+    with ContextExecutor(max_workers=TASK_WORKERS) as executor:
+        # every floor's spaces are normally prefetched already, fetch whatever is missing all at once
+        for _, floor in floors:
+            floor_id = floor["floorId"]
+            if floor_id not in spaces:
+                spaces[floor_id] = {
+                    adjective: executor.submit(get_spaces, token, adjective, task["taskId"], floor_id,
+                                               task["reservationStartTime"], task["reservationEndTime"])
+                    for adjective in ("available", "booked")
+                }
+        occupancies = [get_floor_occupancy(floor, spaces[floor["floorId"]]["available"].result(),
+                                           spaces[floor["floorId"]]["booked"].result(), followings)
+                       for _, floor in floors]
+    # floors with free spaces near coworkers first, then the emptiest
+    occupancies.sort(key=lambda x: (-x["near"], -x["free"]))
+    rows = [["Floor", "Free", "Booked", "Free near\ncoworkers", "Coworkers"]]
+    for occupancy in occupancies:
+        coworkers = occupancy["coworkers"]
+        names = ", ".join(coworkers[:SCAN_MAX_NAMES])
+        if len(coworkers) > SCAN_MAX_NAMES:
+            names = "%s +%d more" % (names, len(coworkers) - SCAN_MAX_NAMES)
+        rows.append([occupancy["floor"]["floorName"], occupancy["free"], occupancy["booked"], occupancy["near"],
+                     names])
+    t = Texttable(max_width=0)
+    t.set_cols_dtype(["t", "i", "i", "i", "t"])
+    t.add_rows(rows)
+    print(t.draw())
+    return occupancies
+
+
+def suggest_spaces(floor, all_spaces, available_space_set, booked_spaces, preferred_space_id):
+    index = get_space_index(floor, all_spaces)
+    if not index:
+        return None
+
+    def is_free(space):
+        return space["uniqueSpaceId"] in available_space_set
+
+    coworkers = [x for x in booked_spaces if x["color"] == COLOR_BOOKED_FOLLOWING and 'Rx' in x]
+    for coworker in coworkers[:SCAN_MAX_NAMES]:
+        space = nearest_space(index, coworker['Rx'], coworker['Ry'], is_free)
+        if space:
+            print("Free next to %s (%s): %s" % (coworker["fullName"], coworker["label"], space["label"]))
+    preferred = next((x for x in booked_spaces if x["spaceId"] == preferred_space_id and 'Rx' in x), None)
+    if not preferred:
+        return None
+    space = nearest_space(index, preferred['Rx'], preferred['Ry'], is_free)
+    if not space:
+        return None
+    print("Your preferred space %s is taken, the nearest free space is %s" % (preferred["label"], space["label"]))
+    radius = NEAR_RADIUS_RATIO * floor.get("baseWidth", 0)
+    nearby = [x for x in spaces_within(index, preferred['Rx'], preferred['Ry'], radius, is_free) if x is not space]
+    nearby.sort(key=lambda x: hypot(x['Rx'] - preferred['Rx'], x['Ry'] - preferred['Ry']))
+    if nearby:
+        print("Also free near %s: %s" % (preferred["label"], ", ".join(x["label"] for x in nearby)))
+    return space["uniqueSpaceId"]
+
+
+def get_space(token, task, floor, config, followings, prefetched=None):
+    import inquirer
+    floor_id = floor["floorId"]
+    available_spaces = get_prefetched_spaces(token, "available", task, floor_id, prefetched)
     default = None
     preferred_space_id = config.get("preferred_space_id")
     if not preferred_space_id:
-        preferred_space_id = inquirer.text(message="Preferred space ID (press return for none)")
+        with phase("prompt"):
+            preferred_space_id = inquirer.text(message="Preferred space ID (press return for none)")
     all_spaces = []
     available_space_set = set()
     for available_space in available_spaces:
@@ -378,16 +1422,13 @@ def get_space(token, task, floor, config, followings):
             default = unique_space_id
         all_spaces.append(available_space)
         available_space_set.add(unique_space_id)
-    booked_spaces = get_spaces(token, "booked", task_id, floor_id, start_time, end_time)
+    booked_spaces = get_prefetched_spaces(token, "booked", task, floor_id, prefetched)
     for booked_space in booked_spaces:
-        space_id = booked_space["spaceId"]
-        if space_id == preferred_space_id:
-            default = booked_space["uniqueSpaceId"]
         full_name = "%s %s" % (booked_space.get("firstName"), booked_space.get("lastName"))
         booked_space["fullName"] = full_name
         booked_space["color"] = COLOR_BOOKED_FOLLOWING if full_name in followings else COLOR_BOOKED
         all_spaces.append(booked_space)
-    all_spaces.sort(key=lambda s: [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', s["label"])])
+    all_spaces.sort(key=lambda s: natural_key(s["label"]))
     choices = []
     for space in all_spaces:
         raw_label = space["label"]
@@ -398,9 +1439,13 @@ def get_space(token, task, floor, config, followings):
             label = "\033[%sm%s (%s)\033[0m" % (color, raw_label, full_name)
         choices.append((label, space["uniqueSpaceId"]))
     try:
-        draw_floor_plan(floor, all_spaces)
+        with phase("draw_floor_plan"):
+            draw_floor_plan(floor, all_spaces)
     except Exception as e:
         print("Failed to draw floor plan: ", e)
+    suggestion = suggest_spaces(floor, all_spaces, available_space_set, booked_spaces, preferred_space_id)
+    if suggestion:
+        default = suggestion
     while True:
         unique_space_id = do_inquiry("Space", choices, default)
         if unique_space_id in available_space_set:
@@ -418,156 +1463,987 @@ def get_booking_map(bookings, space_id=-1):
     return out
 
 
-def run_tasks(token, config, pending_task_ids, followings):
+def prefetch_floors(executor, token, task):
+    task_id = task["taskId"]
+    floors = get_floors(token, task_id)
+    spaces = {}
+    for _, floor in floors:
+        floor_id = floor["floorId"]
+        # only submitted here, never awaited inside the pool
+        spaces[floor_id] = {
+            adjective: executor.submit(get_spaces, token, adjective, task_id, floor_id, task["reservationStartTime"],
+                                       task["reservationEndTime"])
+            for adjective in ("available", "booked")
+        }
+    return floors, spaces
+
+
+def prefetch_task(executor, token, task):
+    task_id = task["taskId"]
+    if not task["taskMetadata"].get("data"):
+        floor_id = task.get("floorId")
+        start_time = task.get("reservationStartTime")
+        end_time = task.get("reservationEndTime")
+        if floor_id and start_time and end_time:
+            return executor.submit(get_spaces, token, "booked", task_id, floor_id, start_time, end_time)
+        return None
+    if task["spaceBookingEnabled"]:
+        return executor.submit(prefetch_floors, executor, token, task)
+    return None
+
+
+def print_task(task):
+    card_info = task["taskMetadata"]["cardInfo"]
+    print("%s:\n\n\t%s %s %s\n\t%s\n\t%s\n" % (
+        task["taskTitle"],
+        card_info.get("displayTitle", ""),
+        card_info.get("title", ""),
+        card_info.get("heading", ""),
+        card_info.get("basicSubtitle", ""),
+        card_info.get("caption", "")
+    ))
+
+
+def get_task_answers(task_data, config, interactive=True):
+    questions = task_data["questions"]
+    if not questions or not task_data["hasQuestionnaire"]:
+        raise Exception("Task without questionnaire not supported")
+    if task_data["hasDocumentAck"]:
+        raise Exception("Task with document acknowledgement not supported")
+    # answers are remembered by question title so they can be reused without a prompt
+    saved_answers = config.setdefault("task_answers", {})
+    answers = []
+    for question in questions:
+        question_id = question["questionId"]
+        question_type = question["answerType"]
+        if question_type != "SINGLE_SELECT":
+            raise Exception("Question type %s not supported" % question_type)
+        question_category = question["questionCategory"]
+        if question_category != "ALL_USERS":
+            raise Exception("Question category %s not supported" % question_category)
+        raw_choices = question["choices"]
+        if not raw_choices:
+            raise Exception("Question missing choices")
+        choices = []
+        for raw_choice in raw_choices:
+            choice_type = raw_choice["choiceType"]
+            if choice_type != "QUALIFY":
+                raise Exception("Choice type %s not supported" % choice_type)
+            choices.append((raw_choice["choiceLabel"], raw_choice["choiceId"]))
+        title = question["questionTitle"].strip()
+        saved_choice_id = next((x[1] for x in choices if x[0] == saved_answers.get(title)), None)
+        if interactive:
+            choice_id = do_inquiry(title, choices, saved_choice_id)
+        elif len(choices) == 1:
+            choice_id = choices[0][1]
+        elif saved_choice_id:
+            choice_id = saved_choice_id
+        else:
+            raise Exception("No saved answer for '%s', answer it once interactively" % title)
+        saved_answers[title] = next(x[0] for x in choices if x[1] == choice_id)
+        answers.append({"questionId": question_id, "choice_id": choice_id})
+    return answers
+
+
+def find_preferred_space(token, task, floors, spaces, preferred_space_id):
+    nearest = None
+    for _, floor in floors:
+        floor_id = floor["floorId"]
+        prefetched = spaces.get(floor_id)
+        available_spaces = get_prefetched_spaces(token, "available", task, floor_id, prefetched)
+        booked_spaces = get_prefetched_spaces(token, "booked", task, floor_id, prefetched)
+        for space in available_spaces:
+            if space["spaceId"] == preferred_space_id:
+                return booked_spaces, space["uniqueSpaceId"]
+        preferred = next((x for x in booked_spaces if x["spaceId"] == preferred_space_id and 'Rx' in x), None)
+        if preferred and not nearest:
+            # the same suggestion the floor plan makes when asking interactively
+            free = {x["uniqueSpaceId"] for x in available_spaces}
+            space = nearest_space(get_space_index(floor, available_spaces + booked_spaces), preferred['Rx'],
+                                  preferred['Ry'], lambda x: x["uniqueSpaceId"] in free)
+            if space:
+                nearest = (booked_spaces, space, preferred)
+    if not nearest:
+        return None, None
+    booked_spaces, space, preferred = nearest
+    print("Your preferred space %s is taken, booking the nearest free space %s" % (preferred["label"], space["label"]))
+    return booked_spaces, space["uniqueSpaceId"]
+
+
+def plan_task(token, config, followings, task, prefetched, interactive):
+    import inquirer
+    task_data = task["taskMetadata"]["data"]
+    if interactive:
+        with phase("prompt"):
+            confirmed = inquirer.confirm("Complete task?", default=True)
+        if not confirmed:
+            return None
+    plan = {"task": task, "answers": get_task_answers(task_data, config, interactive), "responded": False}
+    if not task["spaceBookingEnabled"]:
+        return plan
+    try:
+        floors, spaces = prefetched.result()
+    except ApiException:
+        # the floors may only be available once the task has been responded to
+        respond_to_task(token, task["taskId"], plan["answers"])
+        plan["responded"] = True
+        floors, spaces = get_floors(token, task["taskId"]), {}
+    if interactive:
+        if len(floors) > 1:
+            floors = [(x["floor"]["floorName"], x["floor"])
+                      for x in scan_floors(token, task, floors, spaces, followings)]
+        floor = do_inquiry("Floor", floors, floors[0][1])
+        (plan["bookings"], plan["space_id"]) = get_space(token, task, floor, config, followings,
+                                                         spaces.get(floor["floorId"]))
+    elif config.get("preferred_space_id"):
+        (plan["bookings"], plan["space_id"]) = find_preferred_space(token, task, floors, spaces,
+                                                                    config["preferred_space_id"])
+        if not plan["space_id"]:
+            # the questionnaire is still sent, only the space is left to do
+            plan["space_error"] = "preferred space %s is not available" % config["preferred_space_id"]
+    return plan
+
+
+def complete_task(token, plan):
+    task = plan["task"]
+    task_id = task["taskId"]
+    if not plan["responded"]:
+        respond_to_task(token, task_id, plan["answers"])
+    if plan.get("space_error"):
+        raise Exception("Responded, but %s" % plan["space_error"])
+    space_id = plan.get("space_id")
+    if not space_id:
+        return None
+    return reserve_space(token, task_id, task["reservationStartTime"], task["reservationEndTime"], space_id,
+                         task["recipientId"], task["reservationId"])
+
+
+def run_tasks(token, config, pending_task_ids, followings, interactive=True):
     out = {}
-    for pending_task_id in pending_task_ids:
-        task = get_task(token, pending_task_id)
-        task_id = task["taskId"]
-        task_metadata = task["taskMetadata"]
-        task_data = task_metadata.get("data")
-        card_info = task_metadata["cardInfo"]
-        print("%s:\n\n\t%s %s %s\n\t%s\n\t%s\n" % (
-            task["taskTitle"],
-            card_info.get("displayTitle", ""),
-            card_info.get("title", ""),
-            card_info.get("heading", ""),
-            card_info.get("basicSubtitle", ""),
-            card_info.get("caption", "")
-        ))
-        if not task_data:
-            floor_id = task.get("floorId")
-            start_time = task.get("reservationStartTime")
-            end_time = task.get("reservationEndTime")
-            if floor_id and start_time and end_time:
-                out = get_booking_map(get_spaces(token, "booked", task_id, floor_id, start_time, end_time),
-                                      task.get("spaceId"))
-            continue
-        if not inquirer.confirm("Complete task?", default=True):
+    if not pending_task_ids:
+        return out, 0
+    with ContextExecutor(max_workers=TASK_WORKERS) as executor:
+        # 1. fetch every task, then its floors and spaces, ahead of the prompts
+        tasks = list(executor.map(lambda pending_task_id: get_task(token, pending_task_id), pending_task_ids))
+        prefetches = [prefetch_task(executor, token, task) for task in tasks]
+
+        # 2. gather all the answers in one pass
+        plans = []
+        for task, prefetched in zip(tasks, prefetches):
+            print_task(task)
+            if not task["taskMetadata"].get("data"):
+                if prefetched:
+                    out = get_booking_map(prefetched.result(), task.get("spaceId"))
+                continue
+            try:
+                plan = plan_task(token, config, followings, task, prefetched, interactive)
+            except Exception as e:
+                if interactive:
+                    raise
+                # without a person to ask, skip this task and carry on with the others
+                plan = {"task": task, "error": e}
+            if plan:
+                plans.append(plan)
+        if interactive and any(plan.get("answers") for plan in plans):
+            save_config(config)
+
+        # 3. submit the responses and reservations in parallel
+        submissions = {executor.submit(complete_task, token, plan): plan for plan in plans if "error" not in plan}
+        for future in as_completed(submissions):
+            plan = submissions[future]
+            plan["error"] = future.exception()
+            if not plan["error"]:
+                plan["space_label"] = future.result()
+    failures = 0
+    for plan in plans:
+        title = plan["task"]["taskTitle"]
+        error = plan["error"]
+        if error:
+            failures += 1
+            print("\033[31mFailed\033[0m '%s': %s" % (title, error))
             continue
-        questions = task_data["questions"]
-        if not questions or not task_data["hasQuestionnaire"]:
-            raise Exception("Task without questionnaire not supported")
-        if task_data["hasDocumentAck"]:
-            raise Exception("Task with document acknowledgement not supported")
-        answers = []
-        for question in questions:
-            question_id = question["questionId"]
-            question_type = question["answerType"]
-            if question_type != "SINGLE_SELECT":
-                raise Exception("Question type %s not supported" % question_type)
-            question_category = question["questionCategory"]
-            if question_category != "ALL_USERS":
-                raise Exception("Question category %s not supported" % question_category)
-            raw_choices = question["choices"]
-            if not raw_choices:
-                raise Exception("Question missing choices")
-            choices = []
-            for raw_choice in raw_choices:
-                choice_type = raw_choice["choiceType"]
-                if choice_type != "QUALIFY":
-                    raise Exception("Choice type %s not supported" % choice_type)
-                choices.append([raw_choice["choiceLabel"], raw_choice["choiceId"]])
-            choice_id = do_inquiry(question["questionTitle"].strip(), choices)
-            answers.append({"questionId": question_id, "choice_id": choice_id})
-        respond_to_task(token, task_id, answers)
-        if not task["spaceBookingEnabled"]:
+        space_label = plan.get("space_label")
+        if not space_label:
+            print("Completed '%s'" % title)
             continue
-        floors = get_floors(token, task_id)
-        floor = do_inquiry("Floor", floors)
-        (bookings, space_id) = get_space(token, task, floor, config, followings)
-        start_time = task["reservationStartTime"]
-        end_time = task["reservationEndTime"]
-        user_id = task["recipientId"]
-        reservation_id = task["reservationId"]
-        space_label = reserve_space(token, task_id, start_time, end_time, space_id, user_id, reservation_id)
         print("You have booked '%s'" % space_label)
-        out = get_booking_map(bookings)
+        out = get_booking_map(plan["bookings"])
         out[YOU] = space_label
-    return out
+    return out, failures
+
+
+@lru_cache(maxsize=1024)
+def display_width(text):
+    return sum(2 if east_asian_width(x) in "WF" else 1 for x in text)
+
+
+def write_table(rows, widths, top=True):
+    # writes each row as it comes, with the same layout as texttable
+    border = "+%s+\n" % "+".join("-" * (x + 2) for x in widths)
+    if top:
+        sys.stdout.write(border)
+    for row in rows:
+        cells = [x.split("\n") for x in row]
+        height = max(len(x) for x in cells)
+        lines = []
+        for i in range(height):
+            line = []
+            for cell, width in zip(cells, widths):
+                text = cell[i] if i < len(cell) else ""
+                line.append(" %s%s " % (text, " " * (width - display_width(text))))
+            lines.append("|%s|\n" % "|".join(line))
+        lines.append(border)
+        sys.stdout.write("".join(lines))
+
+
+def print_week(week, today, booked, followings, choices, current_spaces, first=True, failed=(), name_width=0):
+    # followings are bitmasks counted from the first day of the week
+    names, masks = followings or ({}, ())
+    label = "WEEK OF %s" % week[0].strftime('%d %b').upper()
+    header = [label]
+    booking_row = [YOU]
+    for day in week:
+        day_label = day.strftime('%a\n%d')
+        if day == today:
+            day_label = "%s*" % day_label
+        header.append(day_label)
+        is_booked = day in booked
+        booking_row.append(CHECK_MARK if is_booked else CROSS_MARK if day in failed else "")
+        if not is_booked and day >= today:
+            choices.append((day.strftime('%a %d %b'), day))
+    this_week = today in week
+    if current_spaces:
+        header.append("Today's\nSpace" if this_week else "")
+        booking_row.append(current_spaces.get(YOU, "") if this_week else "")
+
+    def rows():
+        yield header
+        yield booking_row
+        for name, mask in zip(names, masks):
+            mask &= WEEKDAY_BITS
+            if not mask:
+                continue
+            row = [name]
+            for x in range(len(week)):
+                row.append(CHECK_MARK if mask >> x & 1 else "")
+            if current_spaces:
+                row.append(current_spaces.get(name, "") if this_week else "")
+            yield row
 
+    # fixed widths so that the weeks line up as one table
+    widths = [max([name_width] + [display_width(x) for x in [label, YOU] + list(names)])] + [3] * len(week)
+    if current_spaces:
+        widths.append(max(display_width(x) for x in ["Today's"] + list(current_spaces.values())))
+    write_table(rows(), widths, first)
 
-def print_weeks(weeks, today, booked, followings, choices, current_spaces):
-    rows = []
-    for week in weeks:
-        label = "WEEK OF %s" % week[0].strftime('%d %b').upper()
-        header = [label]
-        booking_row = [YOU]
-        rows.append(header)
-        rows.append(booking_row)
-        for day in week:
-            day_label = day.strftime('%a\n%d')
-            if day == today:
-                day_label = "%s*" % day_label
-            header.append(day_label)
-            is_booked = day in booked
-            booking_row.append(CHECK_MARK if is_booked else "")
-            if not is_booked and day >= today:
-                choices.append((day.strftime('%a %d %b'), day))
-        if current_spaces:
-            header.append("Today's\nSpace" if today in week else "")
-            booking_row.append(current_spaces.get(YOU, ""))
-        for name, days in followings.items():
-            user_row = [name]
-            add_row = False
-            for day in week:
-                if day in days:
-                    entry = CHECK_MARK
-                    add_row = True
-                else:
-                    entry = ""
-                user_row.append(entry)
-            if current_spaces:
-                space = current_spaces.get(name)
-                if space and today in week:
-                    user_row.append(space)
-                else:
-                    user_row.append("")
-            if add_row:
-                rows.append(user_row)
-    t = Texttable(max_width=0)
-    t.add_rows(rows, header=False)
-    print(t.draw())
 
+def print_weeks(weeks, today, booked, followings, choices, current_spaces, failed=()):
+    for i, week in enumerate(weeks):
+        print_week(week, today, booked, followings, choices, current_spaces, i == 0, failed)
 
-def run():
-    try:
-        from . import __version__
-    except ImportError:
-        __version__ = None
-    version = "unknown" if not __version__ else "v%s" % __version__
-    print("\U0001F332 \033[32mW A W O N A\033[0m \U0001F332\n\n%s - https://github.com/yuzawa-san/wawona\n" % version)
-    config = get_config()
-    token = get_token()
-    try:
-        pending_task_ids = get_pending_tasks(token)
-    except ApiException:
-        token = get_token(True)
-        pending_task_ids = get_pending_tasks(token)
-    today = date.today()
+
+def get_weeks(today, count):
+    # starting from this week, or the next one on weekends
     weekday = today.weekday()
     if weekday < 5:
         start = today - timedelta(days=weekday)
     else:
         start = today + timedelta(days=7 - weekday)
-    days = 14
-    end = start + timedelta(days=days)
-    booked = get_summary(token, start, end)
-    followings = get_followings(token, start, end)
-    current_spaces = run_tasks(token, config, pending_task_ids, followings)
-    choices = []
-    weeks = [[], []]
-    for day_offset in range(days):
-        day = start + timedelta(days=day_offset)
-        weekday = day.weekday()
-        if weekday < 5:
-            weeks[day_offset // 7].append(day)
-    print_weeks(weeks, today, booked, followings, choices, current_spaces)
-    if not choices:
-        return
+    return [[start + timedelta(days=7 * i + x) for x in range(5)] for i in range(count)]
+
+
+def prefetch(executor, token, weeks):
+    # one chunk per week, in order, so the first week can be shown before the last one has loaded
+    return {
+        "pending_task_ids": executor.submit(call_with_token, token, get_pending_tasks),
+        "booked": [executor.submit(call_with_token, token, get_summary, week[0], week[0] + timedelta(days=7))
+                   for week in weeks],
+        "followings": [executor.submit(call_with_token, token, get_followings, week[0],
+                                       week[0] + timedelta(days=7)) for week in weeks],
+        "locations": executor.submit(call_with_token, token, get_locations),
+    }
+
+
+def find_location(locations, name):
+    if not name:
+        if len(locations) == 1:
+            return locations[0][1]
+        raise Exception("Pick an office with --location: %s" % ", ".join(x[0] for x in locations))
+    name = name.lower()
+    matches = [x for x in locations if x[0].lower() == name] or [x for x in locations if name in x[0].lower()]
+    if len(matches) != 1:
+        raise Exception("Office '%s' matches %s" % (name, ", ".join(x[0] for x in matches) or "nothing"))
+    return matches[0][1]
+
+
+def run_batch(args):
+    account()["unattended"] = True
+    config = read_config()
+    if not is_configured(config):
+        print("Not configured yet, run wawona interactively once first.")
+        return EXIT_FAILED
+    if args.space:
+        config["preferred_space_id"] = args.space
+    today = date.today()
+    to_book = [x for x in args.days or [] if x >= today]
+    with ContextExecutor(max_workers=PREFETCH_WORKERS) as executor:
+        with phase("token"):
+            token = get_token()
+        with phase("prefetch"):
+            pending = executor.submit(call_with_token, token, get_pending_tasks)
+            booked = executor.submit(call_with_token, token, get_summary, today,
+                                     max(to_book or [today]) + timedelta(days=1))
+            locations = executor.submit(call_with_token, token, get_locations) if to_book else None
+            booked = booked.result()
+            # known before posting, so that the tasks of the new reservations can be told apart
+            pending_task_ids = pending.result()
+        for day in to_book:
+            if day in booked:
+                print("Already reserved %s" % day.strftime('%a %d %b'))
+        to_book = [x for x in to_book if x not in booked]
+        if to_book:
+            location = find_location(locations.result(), args.location)
+    failures = 0
+    task_ids = list(pending_task_ids)
+    if to_book:
+        token = get_token()
+        # the reservations go out first, the existing tasks are handled together with theirs
+        with phase("add_reservations"):
+            check_tasks, reservation_ids, results = add_reservations(token, location, to_book, config)
+        reserved = sorted(day for day, error in results.items() if not error)
+        if reserved:
+            print("Reserved %s at %s" % (", ".join(x.strftime('%a %d %b') for x in reserved),
+                                         location["locationName"]))
+        print_reservation_failures(results)
+        if len(reserved) < len(results):
+            failures += 1
+        if check_tasks:
+            print("Waiting for pending tasks...")
+            deadline = args.task_deadline or float(config.get("task_poll_deadline", TASK_POLL_DEADLINE))
+            with phase("wait_for_tasks"):
+                new_task_ids = wait_for_tasks(token, reservation_ids, pending_task_ids, deadline)
+            if not new_task_ids:
+                print("Unable to find pending tasks.")
+                failures += 1
+            task_ids += new_task_ids
+    token = get_token()
+    with phase("run_tasks"):
+        _, task_failures = run_tasks(token, config, task_ids, {}, interactive=False)
+    failures += task_failures
+    return EXIT_INCOMPLETE if failures else 0
+
+
+_output = ContextVar("output", default=None)
+
+
+class ContextOutput:
+    # lets accounts running side by side each print to their own buffer
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        return (_output.get() or self.stream).write(text)
+
+    def flush(self):
+        (_output.get() or self.stream).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def run_account(config_path, args):
+    # runs in a context of its own, so the account and output set here stay with this run
+    _account.set(new_account(config_path))
+    output = io.StringIO()
+    _output.set(output)
+    start = perf_counter()
+    try:
+        if isfile(account()["token_file"]):
+            status = run_batch(args)
+        else:
+            print("Not logged in yet, run wawona --config-dir %s once first." % config_path)
+            status = EXIT_FAILED
+    except Exception as e:
+        print("\033[31mFailed\033[0m %s" % e)
+        status = EXIT_FAILED
+    if account()["mutated"]:
+        daemon_request({"op": "invalidate"})
+    return status, perf_counter() - start, output.getvalue()
+
+
+def run_team(args):
+    global RATE_LIMIT
+    RATE_LIMIT = args.rate
+    config_paths = [abspath(expanduser(x)) for x in args.accounts]
+    stdout = sys.stdout
+    sys.stdout = ContextOutput(stdout)
+    results = {}
+    try:
+        with ContextExecutor(max_workers=args.workers) as executor:
+            runs = {executor.submit(run_account, x, args): x for x in config_paths}
+            for future in as_completed(runs):
+                status, seconds, output = future.result()
+                # each account's output in one piece, as soon as it is done
+                stdout.write("== %s ==\n%s\n" % (runs[future], output))
+                results[runs[future]] = (status, seconds)
+    finally:
+        sys.stdout = stdout
+    labels = {0: "done", EXIT_FAILED: "failed", EXIT_INCOMPLETE: "incomplete"}
+    rows = [["Account", "Result", "Seconds"]]
+    for config_path in config_paths:
+        status, seconds = results[config_path]
+        rows.append([config_path, labels.get(status, str(status)), "%.1f" % seconds])
+    write_table(rows, [max(display_width(x) for x in column) for column in zip(*rows)])
+    statuses = [x[0] for x in results.values()]
+    if EXIT_FAILED in statuses:
+        return EXIT_FAILED
+    return EXIT_INCOMPLETE if any(statuses) else 0
+
+
+def find_space_floor(token, task, space_id):
+    with ContextExecutor(max_workers=TASK_WORKERS) as executor:
+        floors, spaces = prefetch_floors(executor, token, task)
+        for _, floor in floors:
+            for adjective in ("available", "booked"):
+                for space in spaces[floor["floorId"]][adjective].result():
+                    if space["spaceId"] == space_id:
+                        return floor
+    raise Exception("Space %s not found on any floor" % space_id)
+
+
+def watch_space(token, task, floor, space_id, deadline, interval):
+    # poll the floor until the space frees up, then book it straight away
+    name = "%s %s" % (task["reservationStartTime"][:10], floor["floorName"])
+    give_up = now() + deadline
+    delay = interval
+    previous = None
+    labels = {}
+    while now() < give_up:
+        # picks up a token refreshed by an earlier poll
+        token = get_token()
+        try:
+            available_spaces = get_spaces(token, "available", task["taskId"], floor["floorId"],
+                                          task["reservationStartTime"], task["reservationEndTime"], True)
+            delay = interval
+        except (ApiException, OSError) as e:
+            if isinstance(e, ApiUnauthorized):
+                # the next poll picks up the new token, as do the other watched tasks
+                refresh_token(token)
+            # back off while the backend is struggling
+            print("%s: %s" % (name, e))
+            delay = min(WATCH_MAX_INTERVAL, delay * 2)
+            available_spaces = None
+        if available_spaces is not None:
+            current = frozenset(x["uniqueSpaceId"] for x in available_spaces)
+            # only look through the spaces when the set actually changed
+            if current != previous:
+                labels.update((x["uniqueSpaceId"], x["label"]) for x in available_spaces)
+                if previous is not None:
+                    print("%s: %s" % (name, " ".join(["+%s" % labels[x] for x in current - previous] +
+                                                     ["-%s" % labels[x] for x in previous - current])))
+                previous = current
+                for space in available_spaces:
+                    if space["spaceId"] != space_id:
+                        continue
+                    try:
+                        return reserve_space(token, task["taskId"], task["reservationStartTime"],
+                                             task["reservationEndTime"], space["uniqueSpaceId"], task["recipientId"],
+                                             task["reservationId"])
+                    except ApiException as e:
+                        print("%s: failed to book %s: %s" % (name, space["label"], e))
+                        previous = None
+        remaining = give_up - now()
+        if remaining > 0:
+            sleep(min(remaining, delay * random.uniform(0.8, 1.2)))
+    return None
+
+
+def watch_task(token, config, task, space_id, deadline, interval):
+    task_data = task["taskMetadata"].get("data")
+    if task_data:
+        respond_to_task(token, task["taskId"], get_task_answers(task_data, config, interactive=False))
+    floor = find_space_floor(token, task, space_id)
+    print("Watching %s on %s for %s" % (space_id, floor["floorName"], task["reservationStartTime"][:10]))
+    return watch_space(token, task, floor, space_id, deadline, interval)
+
+
+def run_watch(args):
+    global RATE_LIMIT
+    RATE_LIMIT = args.rate
+    account()["unattended"] = True
+    config = read_config()
+    if not is_configured(config):
+        print("Not configured yet, run wawona interactively once first.")
+        return EXIT_FAILED
+    space_id = args.space or config.get("preferred_space_id")
+    if not space_id:
+        print("No preferred space configured, pick one with --space.")
+        return EXIT_FAILED
+    with phase("token"):
+        token = get_token()
+    pending_task_ids = call_with_token(token, get_pending_tasks)
+    token = get_token()
+    with ContextExecutor(max_workers=TASK_WORKERS) as executor:
+        tasks = list(executor.map(lambda pending_task_id: get_task(token, pending_task_id), pending_task_ids))
+        # tasks which already have a space are left alone
+        tasks = [x for x in tasks if x["spaceBookingEnabled"] and not x.get("spaceId")]
+        if not tasks:
+            print("No pending tasks need a space.")
+            return EXIT_INCOMPLETE
+        watches = {executor.submit(watch_task, token, config, task, space_id, args.deadline, args.interval): task
+                   for task in tasks}
+        status = 0
+        for future in as_completed(watches):
+            day = watches[future]["reservationStartTime"][:10]
+            try:
+                space_label = future.result()
+            except Exception as e:
+                print("\033[31mFailed\033[0m %s: %s" % (day, e))
+                status = EXIT_FAILED
+                continue
+            if space_label:
+                print("You have booked '%s' for %s" % (space_label, day))
+            else:
+                print("Gave up waiting for %s on %s" % (space_id, day))
+                status = status or EXIT_INCOMPLETE
+    return status
+
+
+def daemon_request(request):
+    import socket
+    daemon_socket = account()["daemon_socket"]
+    if not hasattr(socket, "AF_UNIX") or not exists(daemon_socket):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(DAEMON_TIMEOUT)
+            sock.connect(daemon_socket)
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        response = json.loads(line)
+    except (OSError, ValueError) as e:
+        if VERBOSE:
+            print("DAEMON FAILED: %s" % e)
+        return None
+    if "error" in response:
+        if VERBOSE:
+            print("DAEMON FAILED: %s" % response["error"])
+        return None
+    return response
+
+
+def resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def daemon_fetches(weeks):
+    # the same shape as prefetch, but already resolved from what the daemon holds
+    snapshot = daemon_request({"op": "snapshot"})
+    if not snapshot or snapshot["weeks"][:len(weeks)] != [x[0].isoformat() for x in weeks]:
+        return None
+    age = now() - snapshot["updated"]
+    if VERBOSE:
+        print("DAEMON SNAPSHOT: age=%ds" % age)
+    # a daemon that keeps failing to refresh would otherwise serve its last good view forever
+    if age > 2 * snapshot.get("interval", 0):
+        return None
+    return {
+        "pending_task_ids": resolved(snapshot["pending_task_ids"]),
+        "booked": [resolved({date.fromisoformat(x) for x in days}) for days in snapshot["booked"][:len(weeks)]],
+        "followings": [resolved(({name: i for i, name in enumerate(names)}, array("Q", masks)))
+                       for names, masks in snapshot["followings"][:len(weeks)]],
+        "locations": resolved([tuple(x) for x in snapshot["locations"]]),
+    }
+
+
+def daemon_snapshot(token, weeks):
+    memo_invalidate(DAEMON_ENDPOINTS)
+    with ContextExecutor(max_workers=PREFETCH_WORKERS + 2 * len(weeks)) as executor:
+        fetches = prefetch(executor, token, weeks)
+        return {
+            "weeks": [x[0].isoformat() for x in weeks],
+            "booked": [sorted(x.isoformat() for x in future.result()) for future in fetches["booked"]],
+            "followings": [[list(names), list(masks)]
+                           for names, masks in (future.result() for future in fetches["followings"])],
+            "pending_task_ids": fetches["pending_task_ids"].result(),
+            "locations": fetches["locations"].result(),
+            "updated": now(),
+        }
+
+
+def pick_up_task(token, task_id):
+    # warms the floors in the disk cache so that the client can go straight to the floor plan
+    task = call_with_token(token, get_task, task_id)
+    print("%s: %s %s" % (datetime.now().strftime('%H:%M:%S'), task["taskTitle"],
+                         (task.get("reservationStartTime") or "")[:10]))
+    if task["spaceBookingEnabled"]:
+        call_with_token(token, get_floors, task_id)
+
+
+def serve_daemon_client(conn, snapshot, wake):
+    with conn, conn.makefile("rwb") as f:
+        for line in f:
+            try:
+                op = json.loads(line).get("op")
+            except ValueError:
+                op = None
+            if op == "snapshot":
+                response = snapshot.get("current") or {"error": "not refreshed yet"}
+            elif op == "invalidate":
+                wake.set()
+                response = {"ok": True}
+            elif op == "ping":
+                response = {"ok": True}
+            else:
+                response = {"error": "unknown request"}
+            f.write(json.dumps(response).encode() + b"\n")
+            f.flush()
+
+
+def serve_daemon(server, snapshot, wake):
+    while True:
+        try:
+            conn, _ = server.accept()
+        except OSError:
+            return
+        threading.Thread(target=serve_daemon_client, args=(conn, snapshot, wake), daemon=True).start()
+
+
+def run_daemon(args):
+    import socket
+    daemon_socket = account()["daemon_socket"]
+    config = read_config()
+    if not is_configured(config):
+        print("Not configured yet, run wawona interactively once first.")
+        return EXIT_FAILED
+    if not hasattr(socket, "AF_UNIX"):
+        print("The daemon needs unix sockets, which this platform does not have.")
+        return EXIT_FAILED
+    if daemon_request({"op": "ping"}):
+        print("A daemon is already listening on %s" % daemon_socket)
+        return EXIT_FAILED
+    if exists(daemon_socket):
+        # left behind by a daemon which did not shut down cleanly
+        os.remove(daemon_socket)
+    horizon = args.weeks or int(config.get("weeks", WEEKS))
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(daemon_socket)
+    os.chmod(daemon_socket, 0o600)
+    server.listen()
+    snapshot = {}
+    wake = threading.Event()
+    threading.Thread(target=serve_daemon, args=(server, snapshot, wake), daemon=True).start()
+    print("Listening on %s, refreshing every %ds (ctrl-c to stop)" % (daemon_socket, args.interval))
+    import signal
+    # a plain kill should clean up the socket too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    account()["unattended"] = True
+    known_task_ids = None
+    try:
+        while True:
+            wake.clear()
+            try:
+                current = daemon_snapshot(get_token(), get_weeks(date.today(), horizon))
+            except Exception as e:
+                # clients fetch for themselves rather than being served an outdated view
+                snapshot.pop("current", None)
+                print("Refresh failed: %s" % e)
+            else:
+                current["interval"] = args.interval
+                snapshot["current"] = current
+                task_ids = set(current["pending_task_ids"])
+                failed = set()
+                for task_id in task_ids - (known_task_ids or set()):
+                    try:
+                        pick_up_task(get_token(), task_id)
+                    except Exception as e:
+                        print("Picking up task %s failed: %s" % (task_id, e))
+                        failed.add(task_id)
+                known_task_ids = task_ids - failed
+            wake.wait(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(daemon_socket)
+    return 0
+
+
+def run_offline(args):
+    config = read_config()
+    today = date.today()
+    weeks = get_weeks(today, args.weeks or int(config.get("weeks", WEEKS)))
+    saved = [load_week(week) for week in weeks]
+    current_spaces = {}
+    for _, spaces, _, _ in saved:
+        if today.isoformat() in spaces:
+            current_spaces[YOU] = spaces[today.isoformat()]
+    # everything is known up front, so every week gets the width of the longest name
+    name_width = max(display_width(name) for _, _, (names, _), _ in saved for name in [YOU] + list(names))
+    for i, (week, (booked, _, followings, _)) in enumerate(zip(weeks, saved)):
+        print_week(week, today, booked, followings, [], current_spaces, i == 0, name_width=name_width)
+    updated = [x[3] for x in saved]
+    if None in updated:
+        print("Some weeks have not been fetched yet and are shown empty.")
+    if any(updated):
+        print("Saved on %s" % datetime.fromtimestamp(min(x for x in updated if x)).strftime('%a %d %b %H:%M'))
+    if args.no_refresh or not isfile(account()["token_file"]):
+        return 0
+    # the saved calendar is on screen already, so the network only updates it for next time
+    print("Refreshing the saved calendar...")
+    token = get_token()
+    with ContextExecutor(max_workers=PREFETCH_WORKERS) as executor:
+        fetches = [executor.submit(fn, token, week[0], week[0] + timedelta(days=7))
+                   for week in weeks for fn in (get_summary, get_followings)]
+        for future in fetches:
+            try:
+                future.result()
+            except (ApiException, OSError) as e:
+                print("Could not refresh the saved calendar: %s" % e)
+                return EXIT_INCOMPLETE
+    return 0
+
+
+def run_usual(args):
+    name = args.name or YOU
+    found = usual_days(name)
+    if not found:
+        print("No saved reservations for '%s' yet, they are collected every time wawona runs." % name)
+        return EXIT_FAILED
+    header = [""] + [x.capitalize() for x in WEEKDAYS[:5]]
+    rows = [header]
+    for full_name, weekdays in found.items():
+        row = [full_name]
+        for weekday in range(5):
+            # sqlite counts weekdays from sunday
+            count, seen = weekdays.get((weekday + 1) % 7, (0, 0))
+            row.append("%d/%d" % (count, seen) if count else "")
+        rows.append(row)
+    widths = [max(display_width(x) for x in column) for column in zip(*rows)]
+    write_table(rows, widths)
+    return 0
+
+
+def export_records(token, weeks, fetches):
+    # yields each record as soon as what it needs has arrived
+    for i, week in enumerate(weeks):
+        booked = fetches["booked"][i].result()
+        for day in week:
+            yield {"type": "calendar", "date": day.isoformat(), "name": YOU, "reserved": day in booked}
+        names, masks = fetches["followings"][i].result()
+        for name, mask in zip(names, masks):
+            mask &= WEEKDAY_BITS
+            for x, day in enumerate(week):
+                if mask >> x & 1:
+                    yield {"type": "following", "date": day.isoformat(), "name": name}
+    with ContextExecutor(max_workers=TASK_WORKERS) as executor:
+        tasks = executor.map(lambda task_id: call_with_token(token, get_task, task_id),
+                             fetches["pending_task_ids"].result())
+        for task in tasks:
+            day = task["reservationStartTime"][:10]
+            yield {"type": "task", "id": task["taskId"], "date": day, "name": task["taskTitle"]}
+            if not task["spaceBookingEnabled"]:
+                continue
+            # picks up a token refreshed while fetching the tasks
+            floors, spaces = prefetch_floors(executor, get_token(), task)
+            for _, floor in floors:
+                floor_spaces = spaces[floor["floorId"]]
+                yield {"type": "floor", "id": task["taskId"], "date": day, "floor": floor["floorName"],
+                       "available": len(floor_spaces["available"].result()),
+                       "booked": len(floor_spaces["booked"].result())}
+
+
+def write_records(records, fmt, out):
+    if fmt == "csv":
+        import csv
+        writer = csv.DictWriter(out, RECORD_FIELDS, lineterminator="\n")
+        writer.writeheader()
+    elif fmt == "json":
+        out.write("[")
+    for i, record in enumerate(records):
+        if fmt == "csv":
+            writer.writerow(record)
+        elif fmt == "json":
+            out.write("%s\n%s" % ("," if i else "", json.dumps(record)))
+        else:
+            out.write("%s\n" % json.dumps(record))
+        # whoever reads the other end gets every record right away
+        out.flush()
+    if fmt == "json":
+        out.write("\n]\n")
+
+
+def run_export(args, out):
+    # nothing here prompts or draws tables, so neither inquirer nor texttable gets imported
+    account()["unattended"] = True
+    config = read_config()
+    weeks = get_weeks(date.today(), args.weeks or int(config.get("weeks", WEEKS)))
+    with ContextExecutor(max_workers=PREFETCH_WORKERS + 2 * len(weeks)) as executor:
+        token = get_token()
+        fetches = (not args.no_daemon and daemon_fetches(weeks)) or prefetch(executor, token, weeks)
+        write_records(export_records(token, weeks, fetches), args.format, out)
+    return 0
+
+
+def parse_days(value):
+    today = date.today()
+    days = set()
+    for item in value.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        if item[:3] in WEEKDAYS:
+            # the next occurrence of that weekday, today included
+            days.add(today + timedelta(days=(WEEKDAYS.index(item[:3]) - today.weekday()) % 7))
+            continue
+        try:
+            days.add(date.fromisoformat(item))
+        except ValueError:
+            raise argparse.ArgumentTypeError("'%s' is neither a weekday nor a YYYY-MM-DD date" % item)
+    return sorted(days)
+
+
+def parse_weeks(value):
+    try:
+        weeks = int(value)
+    except ValueError:
+        weeks = 0
+    if weeks < 1:
+        raise argparse.ArgumentTypeError("'%s' is not a positive number of weeks" % value)
+    return weeks
+
+
+def add_common_arguments(parser, suppress=False):
+    # options may also follow a command, but must not clobber ones given before it
+    flag_default = argparse.SUPPRESS if suppress else False
+    value_default = argparse.SUPPRESS if suppress else None
+    parser.add_argument("--verbose", action="store_true", default=flag_default,
+                        help="print API requests and responses")
+    parser.add_argument("--no-cache", action="store_true", default=flag_default, help="bypass the response cache")
+    parser.add_argument("--task-deadline", type=float, metavar="SECONDS", default=value_default,
+                        help="how long to wait for the pending tasks of new reservations (default %d)" %
+                             TASK_POLL_DEADLINE)
+    parser.add_argument("--config-dir", metavar="DIR", default=value_default,
+                        help="configuration of the account to act for (default %s)" %
+                             default_account["config_path"].replace(os.environ["HOME"], "~"))
+    parser.add_argument("--profile", nargs="?", const="wawona-trace.json", metavar="PATH", default=value_default,
+                        help="write a Chrome trace of the run to PATH (default wawona-trace.json) and print a summary")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="wawona",
+                                     description="Easily make office reservations in sequoia from the command line.")
+    add_common_arguments(parser)
+    parser.add_argument("--weeks", type=parse_weeks, metavar="N",
+                        help="number of weeks to show, overrides the weeks config key (default %d)" % WEEKS)
+    parser.add_argument("--no-daemon", action="store_true", help="skip the daemon even if one is running")
+    parser.add_argument("--format", choices=["json", "ndjson", "csv"],
+                        help="print the calendar, followings, pending tasks and free spaces per floor as records "
+                             "instead, without any prompts")
+    commands = parser.add_subparsers(dest="command")
+    add_common_arguments(commands.add_parser("reset", help="remove the configuration"), True)
+    book = commands.add_parser("book", help="reserve days and complete pending tasks without any prompts",
+                               description="Reserve days and complete pending tasks without any prompts, using the "
+                                           "saved questionnaire answers and preferred space. Exits with %d on "
+                                           "error and %d if some of the work could not be completed." %
+                                           (EXIT_FAILED, EXIT_INCOMPLETE))
+    add_common_arguments(book, True)
+    book.add_argument("--days", type=parse_days, metavar="DAYS",
+                      help="comma separated weekdays (next occurrence) or YYYY-MM-DD dates, e.g. Mon,Wed")
+    book.add_argument("--location", metavar="NAME", help="office name, optional if there is only one")
+    book.add_argument("--space", metavar="ID", help="space ID to book instead of the preferred space")
+    watch = commands.add_parser("watch", help="book the preferred space as soon as it frees up",
+                                description="Watch the floor of the preferred space for every pending task without "
+                                            "a space and book it as soon as it is available.")
+    add_common_arguments(watch, True)
+    team = commands.add_parser("team", help="book the same days for several accounts at once",
+                               description="Run the book command for several accounts side by side, each with its "
+                                           "own configuration, token and preferred space, sharing one rate limit. "
+                                           "Exits with %d if any account failed and %d if any could not complete "
+                                           "everything." % (EXIT_FAILED, EXIT_INCOMPLETE))
+    add_common_arguments(team, True)
+    team.add_argument("accounts", nargs="+", metavar="DIR",
+                      help="configuration directory of each account, set up with wawona --config-dir DIR")
+    team.add_argument("--days", type=parse_days, metavar="DAYS",
+                      help="comma separated weekdays (next occurrence) or YYYY-MM-DD dates, e.g. Mon,Wed")
+    team.add_argument("--location", metavar="NAME", help="office name, optional if there is only one")
+    team.add_argument("--workers", type=int, default=TEAM_WORKERS, metavar="N",
+                      help="accounts to run at the same time (default %d)" % TEAM_WORKERS)
+    team.add_argument("--rate", type=float, default=TEAM_RATE, metavar="PER_SECOND",
+                      help="requests per second across all accounts (default %d)" % TEAM_RATE)
+    team.set_defaults(space=None)
+    daemon = commands.add_parser("daemon", help="keep a warm session for faster runs",
+                                 description="Keep the token, connections, calendar and pending tasks warm in the "
+                                             "background, so that wawona can show the calendar right away. Listens "
+                                             "on %s." % default_account["daemon_socket"])
+    add_common_arguments(daemon, True)
+    daemon.add_argument("--weeks", type=parse_weeks, metavar="N", default=argparse.SUPPRESS,
+                        help="number of weeks to keep warm")
+    daemon.add_argument("--interval", type=float, default=DAEMON_INTERVAL, metavar="SECONDS",
+                        help="seconds between refreshes (default %d)" % DAEMON_INTERVAL)
+    offline = commands.add_parser("offline", help="show the saved calendar right away, then refresh it",
+                                  description="Show the calendar saved in %s by earlier runs without waiting for "
+                                              "the network, then refresh it for next time." %
+                                              default_account["state_file"])
+    add_common_arguments(offline, True)
+    offline.add_argument("--weeks", type=parse_weeks, metavar="N", default=argparse.SUPPRESS,
+                         help="number of weeks to show")
+    offline.add_argument("--no-refresh", action="store_true", help="do not touch the network at all")
+    usual = commands.add_parser("usual", help="show which days someone usually comes in",
+                                description="Count the days someone came in per weekday, out of the days saved by "
+                                            "earlier runs.")
+    add_common_arguments(usual, True)
+    usual.add_argument("name", nargs="?", help="part of the name of a coworker you follow (default: you)")
+    watch.add_argument("--space", metavar="ID", help="space ID to watch instead of the preferred space")
+    watch.add_argument("--interval", type=float, default=WATCH_INTERVAL, metavar="SECONDS",
+                       help="seconds between polls, with jitter (default %d)" % WATCH_INTERVAL)
+    watch.add_argument("--deadline", type=float, default=WATCH_DEADLINE, metavar="SECONDS",
+                       help="give up after this many seconds (default %d)" % WATCH_DEADLINE)
+    watch.add_argument("--rate", type=float, default=WATCH_RATE, metavar="PER_SECOND",
+                       help="requests per second across all watched tasks (default %d)" % WATCH_RATE)
+    return parser.parse_args(argv)
+
+
+def run_interactive(args):
+    config = get_config()
+    today = date.today()
+    horizon = args.weeks or int(config.get("weeks", WEEKS))
+    weeks = get_weeks(today, horizon)
+    start = weeks[0][0]
+    end = start + timedelta(days=7 * horizon)
+    with ContextExecutor(max_workers=PREFETCH_WORKERS + 2 * horizon) as executor:
+        with phase("token"):
+            token = get_token()
+        with phase("prefetch"):
+            fetches = (not args.no_daemon and daemon_fetches(weeks)) or prefetch(executor, token, weeks)
+            # every chunk lists the same coworkers, which is all the tasks need
+            followings, _ = fetches["followings"][0].result()
+            pending_task_ids = fetches["pending_task_ids"].result()
+        if not followings:
+            print("You are not following any coworkers.\n"
+                  "Add them in https://px.sequoia.com/workplace or the app, and they will appear calendar below.")
+        # pick up the token again in case one of the fetches had to refresh it
+        token = get_token()
+        with phase("run_tasks"):
+            current_spaces, _ = run_tasks(token, config, pending_task_ids, followings)
+        booked = set()
+        choices = []
+        with phase("print_weeks"):
+            for i, week in enumerate(weeks):
+                week_booked = fetches["booked"][i].result()
+                print_week(week, today, week_booked, fetches["followings"][i].result(), choices, current_spaces,
+                           i == 0)
+                booked |= week_booked
+        if not choices:
+            return
+        locations = fetches["locations"].result()
 
-    locations = get_locations(token)
     location = do_inquiry("Office", locations)
 
+    import inquirer
     questions = [
         inquirer.Checkbox(
             "dates",
@@ -576,25 +2452,103 @@ def run():
         ),
     ]
 
-    answers = inquirer.prompt(questions)
+    with phase("prompt"):
+        answers = inquirer.prompt(questions)
     if not answers:
         return
     to_book = answers["dates"]
     if not to_book:
         print("No reservations added.")
         return
-    check_tasks = add_reservations(token, location, to_book, config)
-    booked = get_summary(token, start, end)
-    print_weeks(weeks, today, booked, {}, [], {})
-    if check_tasks:
-        for i in range(5):
+    with phase("add_reservations"):
+        check_tasks, reservation_ids, results = add_reservations(token, location, to_book, config, booked)
+    with ContextExecutor(max_workers=1) as executor:
+        # render the optimistic calendar right away and check it against the server in the background
+        summary = executor.submit(call_with_token, token, get_summary, start, end)
+        with phase("print_weeks"):
+            print_weeks(weeks, today, booked, None, [], {}, {x for x, error in results.items() if error})
+        print_reservation_failures(results)
+        if check_tasks:
             print("Waiting for pending tasks...")
-            sleep(1)
-            pending_task_ids = get_pending_tasks(token)
+            deadline = args.task_deadline or float(config.get("task_poll_deadline", TASK_POLL_DEADLINE))
+            with phase("wait_for_tasks"):
+                pending_task_ids = wait_for_tasks(token, reservation_ids, pending_task_ids, deadline)
             if pending_task_ids:
-                run_tasks(token, config, pending_task_ids, followings)
-                return
-        print("Unable to find pending tasks.")
+                with phase("run_tasks"):
+                    run_tasks(token, config, pending_task_ids, followings)
+            else:
+                print("Unable to find pending tasks.")
+        actual = summary.result()
+    if actual != booked:
+        # the summary may have lagged behind the reservation, so give it one more chance
+        memo_invalidate(["client/dashboard/summary"])
+        actual = get_summary(token, start, end)
+    reconcile_booked(booked, actual)
+
+
+def run_reported(command, *args):
+    # what runs from cron gets one line and an exit code rather than a traceback
+    try:
+        return command(*args)
+    except Exception as e:
+        print("\033[31mFailed\033[0m %s" % e)
+        return EXIT_FAILED
+
+
+def run():
+    global VERBOSE, NO_CACHE, PROFILE
+    args = parse_args()
+    VERBOSE = args.verbose
+    NO_CACHE = args.no_cache
+    PROFILE = bool(args.profile)
+    if args.config_dir:
+        _account.set(new_account(abspath(expanduser(args.config_dir))))
+    if args.command == "reset" and isfile(account()["config_file"]):
+        print("Removing config file")
+        os.remove(account()["config_file"])
+    try:
+        from . import __version__
+    except ImportError:
+        __version__ = None
+    version = "unknown" if not __version__ else "v%s" % __version__
+    if not args.format:
+        print("\U0001F332 \033[32mW A W O N A\033[0m \U0001F332\n\n%s - https://github.com/yuzawa-san/wawona\n" %
+              version)
+    start = perf_counter()
+    status = 0
+    stdout = sys.stdout
+    if args.format:
+        # the records are all that goes to stdout, so that verbose and profile output cannot corrupt them
+        sys.stdout = sys.stderr
+    try:
+        if args.command == "book":
+            status = run_reported(run_batch, args)
+        elif args.command == "team":
+            status = run_team(args)
+        elif args.command == "watch":
+            status = run_watch(args)
+        elif args.command == "daemon":
+            status = run_daemon(args)
+        elif args.command == "offline":
+            status = run_offline(args)
+        elif args.command == "usual":
+            status = run_usual(args)
+        elif args.format:
+            status = run_reported(run_export, args, stdout)
+        else:
+            run_interactive(args)
+    finally:
+        if account()["mutated"]:
+            # so that a running daemon does not keep serving what was just changed
+            daemon_request({"op": "invalidate"})
+        if VERBOSE:
+            print("MEMO: %(hits)d hits, %(misses)d misses, %(coalesced)d coalesced" % account()["memo_stats"])
+        if PROFILE:
+            trace_event("run", "phase", start)
+            write_profile(args.profile)
+        sys.stdout = stdout
+    if status:
+        sys.exit(status)
 
 
 if __name__ == "__main__":